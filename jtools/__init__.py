@@ -101,6 +101,9 @@ if mari.app.version().number() >= MARI_2_6V1_VERSION_NUMBER:
         def exportSelectedChannels(self):
             export_selected_channels.exportSelectedChannels()
 
+        def exportFromJobSpec(self, job_spec):
+            return export_selected_channels.exportFromJobSpec(job_spec)
+
         def exportUVMasks(self):
             export_uv_masks.exportUVMasks()
 
@@ -116,12 +119,21 @@ if mari.app.version().number() >= MARI_2_6V1_VERSION_NUMBER:
         def importImages(self):
             import_images.importImages()
 
+        def importFromManifest(self, manifest):
+            return import_images.importFromManifest(manifest)
+
         def layerVisibility(self):
             layer_visibility.layerVisibility()
 
         def playblast(self):
             playblaster.playblast()
 
+        def playblastWorker(self, job_path, wait=False):
+            return playblaster.playblastWorker(job_path, wait)
+
+        def playblastJobStatus(self, job_path):
+            return playblaster.playblastJobStatus(job_path)
+
         def resizeChannels(self):
             resize_channels.showUI()
 
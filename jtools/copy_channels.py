@@ -25,6 +25,7 @@
 
 import mari
 import PySide.QtGui as QtGui
+import project_index
 
 version = "0.04"
 
@@ -34,20 +35,13 @@ def copyChannels():
     if not isProjectSuitable(): #Check if project is suitable
         return False    
     
-    geo_list = mari.geo.list()
-    if not fromGeoToGeo():
-        return False
     geo_names = fromGeoToGeo()
-    geo_copy = geo_names[0]
-    geo_paste = geo_names[1]
+    if not geo_names:
+        return False
     
-    for geo in geo_list:
-        if geo_copy == geo.name():
-            geo_copy = geo
-        elif geo_paste == geo.name():
-            geo_paste = geo
-        else:
-            pass
+    index = project_index.ProjectIndex()
+    geo_copy = index.geo(geo_names[0])
+    geo_paste = index.geo(geo_names[1])
     
     checkGeoNames(geo_copy, geo_paste)
     
@@ -58,7 +52,7 @@ def fromGeoToGeo():
     fuInput = fu.getText(fu, 'To copy from','Object name e.g. head_old')
     tu = QtGui.QInputDialog()
     tuInput = tu.getText(tu, 'To copy to','Object name e.g. head_new')
-    geo_names = (fuInput,tuInput)
+    geo_names = (fuInput[0],tuInput[0])
     if '' in geo_names:
         return False
     return geo_names
@@ -66,7 +60,7 @@ def fromGeoToGeo():
 # ------------------------------------------------------------------------------            
 def checkGeoNames(geo_copy, geo_paste):
     "Check the names given are unique and are in the object list"
-    if geo_copy == geo_names[0] or geo_paste == geo_names[1]:
+    if geo_copy is None or geo_paste is None:
         mari.utils.message("Please make sure the names of the objects given match the names in the object list.")
         copyChannels()
     elif geo_copy == geo_paste:
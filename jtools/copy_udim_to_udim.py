@@ -23,7 +23,8 @@
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
 
-import mari
+import mari, os, shutil, tempfile, time
+import udim_mapping, layer_state, formatting
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
 
@@ -33,6 +34,10 @@ USER_ROLE = 32          # PySide.Qt.UserRole
 
 g_u2u_window = None
 g_u2u_cancelled = False
+g_u2u_bytes_per_second = 100.0 * 1024 * 1024     # guess until a copy has been timed this session
+
+ETA_LOG_INTERVAL = 5.0     # seconds between progress log messages
+ETA_STATUS_INTERVAL = 1.0  # seconds between progress status bar updates
 
 # ------------------------------------------------------------------------------
 
@@ -52,7 +57,7 @@ class UserCancelledException(Exception):
 # ------------------------------------------------------------------------------
 
 def showUI():
-    "Copy paint from one or more patches to other patches, for all layers and channels."
+    "Copy paint from one or more patches to other patches, for all layers and channels on one or more objects."
     #Check project state
     if not isProjectSuitable():
         return False
@@ -85,9 +90,8 @@ def showUI():
     channel_header_layout.addWidget(channel_search_icon)
     channel_header_layout.addWidget(filter_box)
     
-    geo = mari.geo.current()
-    for channel in getChannelList(geo):
-        channel_list.addItem(channel.name())
+    for channel in getChannelList():
+        channel_list.addItem(channelLabel(channel))
         channel_list.item(channel_list.count() - 1).setData(USER_ROLE, channel)
     
     channel_layout.addLayout(channel_header_layout)
@@ -149,6 +153,7 @@ def showUI():
     # global copy_line
     copy_line_layout.addWidget(copy_from_text)
     copy_line = QtGui.QLineEdit()
+    copy_line.setPlaceholderText('e.g. 1001-1010,1021 or v1-3')
     copy_line_layout.addWidget(copy_line)
     
     #Create paste layout and add widgets
@@ -156,6 +161,7 @@ def showUI():
     # global paste_line
     paste_line_layout.addWidget(paste_to_text)
     paste_line = QtGui.QLineEdit()
+    paste_line.setPlaceholderText('e.g. 1011-1020,1031 or v+1 or flipu')
     paste_line_layout.addWidget(paste_line)
     
     #Add OK Cancel buttons layout, buttons and add
@@ -180,7 +186,7 @@ def showUI():
 def uncacheBoxTicked(uncache_layers_box):
     "Warning message for uncache tick box."
     if uncache_layers_box.isChecked():
-        mari.utils.message("Please be aware that uncaching and re-caching the layers could take some time")
+        mari.utils.message("Please be aware that uncaching and re-caching the layers being copied to could take some time")
     
 # ------------------------------------------------------------------------------   
 class ChannelsToCopyList(QtGui.QListWidget):
@@ -207,7 +213,7 @@ class ChannelsToCopyList(QtGui.QListWidget):
             channel = item.data(USER_ROLE)
             if channel not in current_channels:
                 current_channels.add(channel)
-                self.addItem(channel.name())
+                self.addItem(item.text())
                 self.item(self.count() - 1).setData(USER_ROLE, channel)
         
     def removeChannels(self):
@@ -217,7 +223,7 @@ class ChannelsToCopyList(QtGui.QListWidget):
             self.takeItem(index)    
 
 # ------------------------------------------------------------------------------     
-def checkBox(ui, channels_to_copy, unlock_channels_box, uncache_layers_box, unlock_layers_box, copy_udim_list, paste_udim_list):
+def checkBox(ui, channels_to_copy, unlock_channels_box, uncache_layers_box, unlock_layers_box, mapping):
     "This is where the check boxes are queried and where lists are generated for functions."
     unlock_channels = unlock_channels_box.isChecked()
     uncache_layers = uncache_layers_box.isChecked()
@@ -225,167 +231,145 @@ def checkBox(ui, channels_to_copy, unlock_channels_box, uncache_layers_box, unlo
     
     channels_to_copy_list = channels_to_copy.currentChannels()
 
-    channels_locked = []
-    layers_locked = []
-    layers_cached = []
-    
-    if unlock_channels:
-        for channel in channels_to_copy_list:
-            channels_locked.extend(getLockedChannels(channels_to_copy_list))
-        unlockOrLockList(channels_locked, False)
-    
-    if uncache_layers:
-        for channel in channels_to_copy_list:
-            layers_cached.extend(getCachedLayers(channel.layerList()))
-        uncacheOrCacheList(layers_cached, False)
-    
-    if (unlock_layers == True) and (uncache_layers == False):
-        for channel in channels_to_copy_list:
-            layers_locked.extend(getLockedLayers(channel.layerList()))
-            layers_cached.extend(getCachedLayers(channel.layerList()))
-        for layer in layers_locked:
-            if layer in layers_cached:
-                layers_locked.remove(layer)
-        unlockOrLockList(layers_locked, False)
-        
-    elif unlock_layers:
-        for channel in channels_to_copy_list:
-            layers_locked.extend(getLockedLayers(channel.layerList()))
-        unlockOrLockList(layers_locked, False)
-        
-    copy_udim_list = udimToIndex(copy_udim_list)
-    paste_udim_list = udimToIndex(paste_udim_list)
-
-    whatToCopy(channels_to_copy_list, copy_udim_list, paste_udim_list, unlock_channels, uncache_layers, unlock_layers)
-
-    if len(layers_cached) == 0:
-        pass
-    else:
-        uncacheOrCacheList(layers_cached, True)
-    
-    if len(layers_locked) == 0:
-        pass
-    else:
-        unlockOrLockList(layers_locked, True)
-            
-    if len(channels_locked) == 0:
-        pass
-    else:
-        unlockOrLockList(channels_locked, True)
+    #Plan and check the copy before changing anything
+    plan = planCopy(channels_to_copy_list, udimToIndex(mapping.copyUdims()), udimToIndex(mapping.pasteUdims()), unlock_channels, uncache_layers, unlock_layers)
+    for cycle in mapping.cycles():
+        plan.notes.append('%s are pasted onto each other, the original paint is used' %' > '.join([str(udim) for udim in cycle + cycle[:1]]))
+    if not confirmCopyPlan(plan):
+        return
+
+    #Only unlock and uncache what the plan writes to, everything is put back even if the copy fails
+    state = layer_state.LayerState()
+    try:
+        state.unlockChannels(plan.channels)
+        state.unlockLayers(plan.layers())
+        state.uncacheLayers(plan.layers())
+        executeCopyPlan(plan)
+    except UserCancelledException:
+        mari.utils.message("Copy cancelled, undo Copy Udim To Udim to remove the tiles already copied.")
+    finally:
+        state.restore()
             
     #Close Qt dialog
     ui.accept()
 
 # ------------------------------------------------------------------------------
-def whatToCopy(channels_to_copy_list, copy_udim_list, paste_udim_list, unlock_channels, uncache_layers, unlock_layers):
-    "Checks channel list against tick boxes and runs copy accordingly"
-    channels_to_copy = channels_to_copy_list
-    
-    if unlock_channels and uncache_layers and unlock_layers:
-        for channel in channels_to_copy:
-            layer_list = getMatchingLayers(channel.layerList(), returnTrue)
-            maskToMaskStack(layer_list)
-            layer_list = getMatchingLayers(channel.layerList(), returnTrue)
-            layer_list = getPaintableLayers(layer_list)
-            copyUdimToUdim(copy_udim_list, paste_udim_list, layer_list)
-            
-    if unlock_channels and uncache_layers or not uncache_layers and unlock_layers or not unlock_layers:
-        for channel in channels_to_copy:
-            layer_list = getMatchingLayers(channel.layerList(), returnTrue)
-            layer_list = getModifiableLayers(layer_list)
-            layer_list = maskToMaskStack(layer_list)
-            layer_list = getPaintableLayers(layer_list)
-            copyUdimToUdim(copy_udim_list, paste_udim_list, layer_list)
-            
-    if not unlock_channels and uncache_layers or not uncache_layers and unlock_layers or not unlock_layers:
-        channels_locked = getLockedChannels(channels_to_copy)
-        for channel in channels_to_copy:
-            if channel in channels_locked:
-                channels_to_copy.remove(channel)
-        for channel in channels_to_copy:
-            layer_list = getMatchingLayers(channel.layerList(), returnTrue)
-            layer_list = getModifiableLayers(layer_list)
-            layer_list = maskToMaskStack(layer_list)
-            layer_list = getPaintableLayers(layer_list)
-            copyUdimToUdim(copy_udim_list, paste_udim_list, layer_list)
-            
-# ------------------------------------------------------------------------------  
-def copyUdimRange(layer_list, copy_udim_list, paste_udim_list):
-            "Pass each udim and layer list to the copyUdimToUdim function"
-            for index in range(len(copy_udim_list)):
-                copyUdimToUdim(copy_udim_list[index], paste_udim_list[index], layer_list)
+class CopyPlan(object):
+    "Deduplicated list of (layer, image set kind, copy index, paste index) operations to run, with anything left out and why and notes for the user."
+    
+    def __init__(self):
+        self.operations = []
+        self.channels = []
+        self.layer_channels = {}
+        self.skipped = []
+        self.notes = []
+        self._keys = set()
+        
+    def add(self, layer, kind, copy_index, paste_index):
+        "Adds an operation unless the same one is already planned."
+        key = (layer, kind, copy_index, paste_index)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        self.operations.append(key)
+        
+    def skip(self, name, reason):
+        "Records a channel or layer that won't be copied."
+        self.skipped.append((name, reason))
+        
+    def size(self):
+        "Returns the number of tile copies the plan will run."
+        return len(self.operations)
+        
+    def layers(self):
+        "Returns the layers in the plan, in the order they are copied."
+        layers = []
+        for layer, kind, copy_index, paste_index in self.operations:
+            if layer not in layers:
+                layers.append(layer)
+        return layers
+
+# ------------------------------------------------------------------------------
+def planCopy(channel_list, copy_index_list, paste_index_list, unlock_channels, uncache_layers, unlock_layers):
+    "Turns the dialog options into one copy plan for channels on any geo, each layer image is copied once however the options overlap."
+    plan = CopyPlan()
+    index_pairs = zip(copy_index_list, paste_index_list)
+    geo_uv_indexes = {}
+    checked_channels = []
+    for channel in channel_list:
+        if channel in checked_channels:
+            continue
+        checked_channels.append(channel)
+        if channel.isLocked() and not unlock_channels:
+            plan.skip(channelLabel(channel), 'channel is locked')
+            continue
+        #Each geo only copies the UDIMs it has
+        geo = channel.geoEntity()
+        if geo not in geo_uv_indexes:
+            geo_uv_indexes[geo] = set([patch.uvIndex() for patch in geo.patchList()])
+        uv_indexes = geo_uv_indexes[geo]
+        channel_pairs = [pair for pair in index_pairs if pair[0] in uv_indexes and pair[1] in uv_indexes]
+        if len(channel_pairs) < len(index_pairs):
+            missing = set([index for pair in index_pairs for index in pair]) - uv_indexes
+            plan.skip(channelLabel(channel), 'has no UDIM %s' %udim_mapping.formatUdims([index + udim_mapping.UDIM_START for index in missing]))
+        if len(channel_pairs) == 0:
+            continue
+        for layer in getMatchingLayers(channel.layerList(), returnTrue):
+            kinds = getLayerImageKinds(layer)
+            if not kinds:
+                continue
+            if layer.isLocked() and not unlock_layers:
+                plan.skip('%s : %s' %(channelLabel(channel), layer.name()), 'layer is locked')
+                continue
+            if layer.isLayerCached() and not uncache_layers:
+                plan.skip('%s : %s' %(channelLabel(channel), layer.name()), 'layer is cached')
+                continue
+            for kind in kinds:
+                for copy_index, paste_index in channel_pairs:
+                    plan.add(layer, kind, copy_index, paste_index)
+            plan.layer_channels[layer] = channel
+            if channel not in plan.channels:
+                plan.channels.append(channel)
+    return plan
+
+# ------------------------------------------------------------------------------
+def confirmCopyPlan(plan):
+    "Show the plan size and anything left out, returns True if the user wants to go ahead."
+    if plan.size() == 0:
+        mari.utils.message("Nothing to copy, all layers are locked, cached or not paintable.")
+        return False
+    bytes_ = estimateCopyBytes(plan)
+    text = 'Copy %d tiles across %d layers in %d channels?' %(plan.size(), len(plan.layers()), len(plan.channels))
+    text += '\nAbout %s to read and write, estimated time %s.' %(formatting.formatBytes(bytes_), formatting.formatSeconds(bytes_ / g_u2u_bytes_per_second))
+    dialog = QtGui.QMessageBox()
+    dialog.setWindowTitle('Copy Udim To Udim')
+    dialog.setText(text)
+    if plan.skipped:
+        dialog.setInformativeText('%d channels or layers will be left out.' %len(plan.skipped))
+    if plan.skipped or plan.notes:
+        dialog.setDetailedText('\n'.join(plan.notes + ['%s : %s' %(name, reason) for name, reason in plan.skipped]))
+    dialog.setStandardButtons(QtGui.QMessageBox.Ok | QtGui.QMessageBox.Cancel)
+    dialog.setDefaultButton(QtGui.QMessageBox.Ok)
+    return dialog.exec_() == QtGui.QMessageBox.Ok
        
 # ------------------------------------------------------------------------------  
 def compareInput(g_u2u_window, channels_to_copy, unlock_channels_box, uncache_layers_box, unlock_layers_box, copy_line, paste_line):
-    "Check copy and paste input from the dialog are udim numbers i.e. 1001 - 9999, and not alphabetical, they can contain multiple ranges and individual udims i.e. 1001-1005,1006,1009,1021-1030"
-
-    copy_line = copy_line.text()
-    paste_line = paste_line.text()
-    copy_list = copy_line.split(',')
-    paste_list = paste_line.split(',')           
-    copy_udim_check = []
-    paste_udim_check = []
-    copy_udim_list = []
-    paste_udim_list = []
-    check_list = []
-    check = False
-    
-    for item in copy_list:
-        if '-' in item:
-            item_list = item.split('-')
-            ranges = []
-            for item in item_list:
-                if item.isdigit() and int(item) >= 1001 and len(item) == 4:
-                    ranges.append(int(item))
-                else:
-                    check_list.append(False)
-            ranges.sort()
-            range_list = range(ranges[0], ranges[1] + 1)
-            copy_udim_check.append(len(range_list))
-            copy_udim_list.extend(range_list)
-        elif item.isdigit() and len(item) == 4 and int(item) >= 1001:
-            copy_udim_check.append(1)
-            copy_udim_list.append(int(item))
-        else:
-            check_list.append(False)
-       
-    for item in paste_list:
-        if '-' in item:
-            item_list = item.split('-')
-            ranges = []
-            for item in item_list:
-                if item.isdigit() and int(item) >= 1001 and len(item) == 4:
-                    ranges.append(int(item))
-                else:
-                    check_list.append(False)
-            ranges.sort()
-            range_list = range(ranges[0], ranges[1] + 1)
-            paste_udim_check.append(len(range_list))
-            paste_udim_list.extend(range_list)
-        elif item.isdigit() and len(item) == 4 and int(item) >= 1001:
-            paste_udim_check.append(1)
-            paste_udim_list.append(int(item))
-        else:
-            check_list.append(False)
-
-    if len(copy_udim_check) == len(paste_udim_check):
-        for i in range(len(copy_udim_check)):
-            if copy_udim_check[i] == paste_udim_check[i]:
-                check_list.append(True)
-            else:
-                check_list.append(False)
-    
-    if len(check_list) == 0:
-        check = False
-    elif False in check_list:
-        check = False
-    else:
-        check = True
-        
-    if check == False:
-        mari.utils.message("Please enter matching UDIM ranges for copying, i.e. Copy UDIM: 1001-1005,1009 Paste UDIM: 1016-1020,1032")
-    else:
-        checkBox(g_u2u_window, channels_to_copy, unlock_channels_box, unlock_layers_box, uncache_layers_box, copy_udim_list, paste_udim_list)
+    "Parse the copy UDIMs and the paste UDIMs or transform from the dialog into a UDIM mapping, see udim_mapping for the syntax."
+    channels_to_copy_list = channels_to_copy.currentChannels()
+    available = set()
+    for channel in channels_to_copy_list:
+        available.update([patch.uvIndex() + udim_mapping.UDIM_START for patch in channel.geoEntity().patchList()])
+    if len(available) == 0:
+        available = None
+
+    try:
+        mapping = udim_mapping.parseMapping(copy_line.text(), paste_line.text(), available)
+        mapping.validate(available)
+    except udim_mapping.UdimMappingError, e:
+        mari.utils.message("%s\n\nPlease enter matching UDIMs or a transform for copying, i.e. Copy UDIM: 1001-1005,1009 Paste UDIM: 1016-1020,1032 or Copy UDIM: v1-3 Paste UDIM: v+1" %e)
+        return
+
+    checkBox(g_u2u_window, channels_to_copy, unlock_channels_box, uncache_layers_box, unlock_layers_box, mapping)
         
 # ------------------------------------------------------------------------------  
 def udimToIndex(udim_list):
@@ -397,56 +381,6 @@ def udimToIndex(udim_list):
     
     return index_list
 
-# ------------------------------------------------------------------------------  
-def unlockOrLockList(List, bool):
-    "Unlocks or locks list of channels/layers depending on what is passed to it."
-    for obj in List:
-        obj.setLocked(bool)
-        
-# ------------------------------------------------------------------------------
-def uncacheOrCacheList(List, bool):
-    "Uncaches or caches a list of layers."
-    uncache = mari.actions.get('/Mari/Layers/Uncache Layer')
-    cache = mari.actions.get('/Mari/Layers/Cache Layer')
-    if bool:
-        for layer in List:
-            layer.makeCurrent()
-            cache.trigger()
-    else:
-        for layer in List:
-            layer.makeCurrent()
-            uncache.trigger()
-
-# ------------------------------------------------------------------------------  
-def getLockedChannels(channel_list):
-    "Returns a list of all the locked channels."
-    matching = []
-    for channel in channel_list:
-        if channel.isLocked():
-            matching.append(channel)
-            
-    return matching
-    
-# ------------------------------------------------------------------------------
-def getCachedLayers(layer_list):
-    "Returns a list of all of the cached layers in the layer stack, including in substacks."
-    return getMatchingLayers(layer_list, mari.Layer.isLayerCached)
-
-# ------------------------------------------------------------------------------
-def getLockedLayers(layer_list):
-    "Returns a list of all of the locked layers in the layer stack, including in substacks."
-    return getMatchingLayers(layer_list, mari.Layer.isLocked)
-
-# ------------------------------------------------------------------------------
-def getPaintableLayers(layer_list):
-    "Returns a list of all of the paintable layers in the layer stack, including in substacks."
-    return getMatchingLayers(layer_list, mari.Layer.isPaintableLayer)
-    
-# ------------------------------------------------------------------------------
-def getModifiableLayers(layer_list):
-    "Returns a list of all of the modifiable layers in the layer stack, including in substacks."
-    return getMatchingLayers(layer_list, mari.Layer.isModifiable)
-
 # ------------------------------------------------------------------------------    
 def returnTrue(layer):
     "Returns True for any object passed to it."
@@ -468,18 +402,6 @@ def getMatchingLayers(layer_list, criterionFn):
         
     return matching
 
-# ------------------------------------------------------------------------------
-def maskToMaskStack(layer_list):
-    "Returns a list of all of the layers in the stack that match the given criterion function, including substacks."
-    matching = []
-    for layer in layer_list:
-        matching.append(layer)
-        if layer.hasMask() and (layer.hasMaskStack() == False):
-            layer.makeMaskStack()
-            matching.extend(maskToMaskStack(layer.maskStack().layerList()))
-            
-    return matching
-
 # ------------------------------------------------------------------------------
 def updateFilter(filter_box, channel_list):
     "For each item in the channel list display, set it to hidden if it doesn't match the filter text."
@@ -509,10 +431,6 @@ def isProjectSuitable():
         if chan is None:
             mari.utils.message("Please select a channel to copy from.")
             return False
-            
-        if len(chan.layerList()) == 0:
-            mari.utils.message("No layers to copy from!")
-            return False
 
         return True
     
@@ -521,39 +439,154 @@ def isProjectSuitable():
         return False
     
 # ------------------------------------------------------------------------------   
-def copyUdimToUdim(copy_index, paste_index, layer_list):
-    "Copies udim to udim."
-    # un-select patches
-    patches = mari.geo.current().selectedPatches()
-    if patches == None:
-        pass
-    else:
-        for patch in patches:
-            patch.setSelected(False)
-   
-    copy = mari.actions.get('/Mari/Project/Project Explorer/Quick Copy')
-    paste = mari.actions.get('/Mari/Project/Project Explorer/Quick Paste')
-    
-    for i in range(len(copy_index)):
-        for layer in layer_list:
-            # un-select layers
-            layer.makeCurrent()
-            layer.setSelected(False)
+def executeCopyPlan(plan):
+    "Runs every operation in the copy plan once, the layer and mask images are copied directly without touching the patch or layer selection. Raises UserCancelledException if cancelled."
+    global g_u2u_cancelled
+    global g_u2u_bytes_per_second
+    g_u2u_cancelled = False
+    grouped = {}
+    order = []
+    for layer, kind, copy_index, paste_index in plan.operations:
+        if (layer, kind) not in grouped:
+            grouped[(layer, kind)] = []
+            order.append((layer, kind))
+        grouped[(layer, kind)].append((copy_index, paste_index))
+    steps = sum([len(set([pair[0] for pair in pairs])) + len(pairs) for pairs in grouped.values()])
+    temp_dir = tempfile.mkdtemp(prefix='jtools_u2u_')
+    mari.history.startMacro('Copy Udim To Udim')
+    progress = CopyProgress(estimateCopyBytes(plan), steps)
+    try:
+        for layer, kind in order:
+            copyImageSetUdims(getLayerImageSet(layer, kind), grouped[(layer, kind)], temp_dir, progress, plan.layer_channels[layer])
+    finally:
+        mari.history.stopMacro()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        progress.stop()
+    if progress.elapsed() > 0:
+        g_u2u_bytes_per_second = max(progress.bytes_done / progress.elapsed(), 1.0)
+
+# ------------------------------------------------------------------------------   
+class CopyProgress(object):
+    "Steps Mari's progress bar for every tile read or written, logs the ETA and raises UserCancelledException when cancelled."
+    
+    def __init__(self, total_bytes, steps):
+        self.total_bytes = total_bytes
+        self.bytes_done = 0
+        self.start = time.time()
+        self.last_log = self.start
+        self.last_status = self.start
+        self.status_bar = mainStatusBar()
+        mari.app.startProcessing('Copying UDIMs...', steps, can_cancel=True)
+        
+    def step(self, bytes_):
+        "Counts one tile read or written, checks for a cancel between tiles so every tile is either fully copied or untouched."
+        global g_u2u_cancelled
+        self.bytes_done += bytes_
+        mari.app.stepProgress()
+        now = time.time()
+        if now - self.last_status > ETA_STATUS_INTERVAL and self.bytes_done > 0:
+            self.last_status = now
+            text = self.eta()
+            if self.status_bar is not None:
+                self.status_bar.showMessage(text)
+            if now - self.last_log > ETA_LOG_INTERVAL:
+                self.last_log = now
+                mari.app.log(text)
+        QtGui.QApplication.processEvents()
+        if mari.app.wasProcessingCancelled():
+            g_u2u_cancelled = True
+            raise UserCancelledException()
             
-            layer.makeCurrent()
-            mari.geo.current().patch(copy_index[i]).setSelected(True)
-            copy.trigger()
-            mari.geo.current().patch(copy_index[i]).setSelected(False)
-            mari.geo.current().patch(paste_index[i]).setSelected(True)
-            paste.trigger()
-            mari.geo.current().patch(paste_index[i]).setSelected(False)
-            layer.setSelected(False)
+    def eta(self):
+        "Returns the percentage done and the estimated time left."
+        remaining = (self.total_bytes - self.bytes_done) * self.elapsed() / self.bytes_done
+        return 'Copy Udim To Udim %d%% done, about %s left' %(100 * self.bytes_done / max(self.total_bytes, 1), formatting.formatSeconds(remaining))
+
+    def elapsed(self):
+        "Returns the seconds since the copy started."
+        return time.time() - self.start
+        
+    def stop(self):
+        "Closes Mari's progress bar and clears the estimate from the status bar."
+        mari.app.stopProcessing()
+        if self.status_bar is not None:
+            self.status_bar.clearMessage()
+
+# ------------------------------------------------------------------------------
+def mainStatusBar():
+    "Returns the status bar of Mari's main window, or None if it can't be found."
+    for widget in QtGui.QApplication.topLevelWidgets():
+        if isinstance(widget, QtGui.QMainWindow):
+            return widget.statusBar()
+    return None
+
+# ------------------------------------------------------------------------------   
+def estimateCopyBytes(plan):
+    "Returns the bytes the plan reads and writes, every tile is saved once and loaded once for each paste."
+    bytes_ = 0
+    saved = set()
+    for layer, kind, copy_index, paste_index in plan.operations:
+        channel = plan.layer_channels[layer]
+        if (layer, kind, copy_index) not in saved:
+            saved.add((layer, kind, copy_index))
+            bytes_ += tileBytes(channel, copy_index)
+        bytes_ += tileBytes(channel, paste_index)
+    return bytes_
+
+# ------------------------------------------------------------------------------   
+def tileBytes(channel, uv_index):
+    "Returns the uncompressed size of one RGBA channel tile."
+    return channel.width(uv_index) * channel.height(uv_index) * 4 * channel.depth() / 8
+
+# ------------------------------------------------------------------------------   
+def getLayerImageKinds(layer):
+    "Returns which of the layer's image sets can be copied, its paint and its mask if it has a mask without a mask stack."
+    kinds = []
+    if layer.isPaintableLayer():
+        kinds.append('paint')
+    if layer.hasMask() and not layer.hasMaskStack():
+        kinds.append('mask')
+    return kinds
+
+# ------------------------------------------------------------------------------   
+def getLayerImageSet(layer, kind):
+    "Returns the layer's paint or mask image set."
+    if kind == 'mask':
+        return layer.maskImageSet()
+    return layer.imageSet()
+
+# ------------------------------------------------------------------------------   
+def copyImageSetUdims(image_set, index_pairs, temp_dir, progress, channel):
+    "Copies every (copy index, paste index) pair in one image set, all copy images are read before any are pasted so overlapping ranges copy the original paint."
+    copied = {}
+    try:
+        for copy_index, paste_index in index_pairs:
+            if copy_index not in copied:
+                copied[copy_index] = os.path.join(temp_dir, '%d.tif' %copy_index)
+                image_set.image(copy_index).saveAs(copied[copy_index], None, 0)
+                progress.step(tileBytes(channel, copy_index))
+        for copy_index, paste_index in index_pairs:
+            image_set.image(paste_index).load(copied[copy_index])
+            progress.step(tileBytes(channel, paste_index))
+    finally:
+        for path in copied.values():
+            if os.path.exists(path):
+                os.remove(path)
     
 # ------------------------------------------------------------------------------
-def getChannelList(geo):
-    "Return a list of channels"
-    channels = geo.channelList()
+def getChannelList():
+    "Return a list of channels on every geo, the current geo's channels first then each geo by name, shader stacks are left out."
+    current_geo = mari.geo.current()
+    geo_list = [current_geo] + sorted([geo for geo in mari.geo.list() if geo is not current_geo], key=lambda x: x.name())
+    channels = []
+    for geo in geo_list:
+        channels.extend([channel for channel in sorted(geo.channelList(), key=lambda x: x.name().lower()) if not channel.isShaderStack()])
     return channels
+
+# ------------------------------------------------------------------------------
+def channelLabel(channel):
+    "Return the channel name with its geo name."
+    return '%s : %s' %(channel.geoEntity().name(), channel.name())
     
 # ------------------------------------------------------------------------------            
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Scan directory trees for files on worker threads, with a cache of listings
+# coding: utf-8
+# Written by Jorel Latraille
+# ------------------------------------------------------------------------------
+# DISCLAIMER & TERMS OF USE:
+#
+# Copyright (c) The Foundry 2014.
+# All rights reserved.
+#
+# This software is provided as-is with use in commercial projects permitted.
+# Redistribution in commercial projects is also permitted
+# provided that the above copyright notice and this paragraph are
+# duplicated in accompanying documentation,
+# and acknowledge that the software was developed
+# by The Foundry.  The name of the
+# The Foundry may not be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND WITHOUT ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+import os, threading, Queue
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+version = "0.01"
+
+SCAN_THREAD_COUNT = 8
+PROGRESS_INTERVAL = 0.1     # seconds between progress callbacks
+
+_SCAN_CACHE = {}            # directory path : (mtime, file names, sub directory paths)
+_SCAN_CACHE_LOCK = threading.Lock()
+
+# ------------------------------------------------------------------------------
+class DirectoryScanner(object):
+    """Walks a directory tree on worker threads, each directory is listed by one thread and its sub directories
+    are queued for the others. Listings are cached by directory path and mtime so a rescan only lists
+    directories that changed. Files are filtered on the worker threads, Mari objects must not be used in filterFn."""
+    def __init__(self, root, filterFn=None, thread_count=SCAN_THREAD_COUNT):
+        self.root = os.path.abspath(root)
+        self.filterFn = filterFn
+        self.thread_count = thread_count
+        self.results = []
+        self.directories_scanned = 0
+        self.directories_cached = 0
+        self.cancelled = False
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def run(self, progressFn=None):
+        """Scan the tree, progressFn(directories scanned, files found) is called every PROGRESS_INTERVAL seconds
+        on the calling thread and can return False to cancel. Returns False if the scan was cancelled."""
+        self._queue.put(self.root)
+        threads = []
+        for index in range(self.thread_count):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        waiter = threading.Thread(target=self._wait)
+        waiter.daemon = True
+        waiter.start()
+        while not self._done.is_set():
+            self._done.wait(PROGRESS_INTERVAL)
+            if progressFn is not None and not self.cancelled:
+                if progressFn(self.directories_scanned, len(self.results)) is False:
+                    self.cancelled = True
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        self.results.sort(key=lambda x: (x[0], x[1]))
+        return not self.cancelled
+
+    def _wait(self):
+        self._queue.join()
+        self._done.set()
+
+    def _work(self):
+        while True:
+            directory = self._queue.get()
+            if directory is None:
+                return
+            try:
+                if not self.cancelled:
+                    self._scan(directory)
+            finally:
+                self._queue.task_done()
+
+    def _scan(self, directory):
+        "List one directory, queue its sub directories and keep the files that pass the filter."
+        files, sub_directories, cached = listDirectory(directory)
+        for sub_directory in sub_directories:
+            self._queue.put(sub_directory)
+        matched = []
+        for file_name in files:
+            if self.filterFn is None:
+                matched.append((directory, file_name, None))
+                continue
+            match = self.filterFn(file_name)
+            if match:
+                matched.append((directory, file_name, match))
+        with self._lock:
+            self.results.extend(matched)
+            self.directories_scanned += 1
+            if cached:
+                self.directories_cached += 1
+
+# ------------------------------------------------------------------------------
+def listDirectory(directory):
+    "Returns (file names, sub directory paths, True if the listing came from the cache), unreadable directories are empty."
+    try:
+        mtime = os.stat(directory).st_mtime
+    except OSError:
+        return [], [], False
+    with _SCAN_CACHE_LOCK:
+        cached = _SCAN_CACHE.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2], True
+    try:
+        files, sub_directories = _listDirectory(directory)
+    except OSError:
+        return [], [], False
+    with _SCAN_CACHE_LOCK:
+        _SCAN_CACHE[directory] = (mtime, files, sub_directories)
+    return files, sub_directories, False
+
+# ------------------------------------------------------------------------------
+def _listDirectory(directory):
+    "Returns the file names and sub directory paths in a directory, symbolic links to directories are not followed."
+    files = []
+    sub_directories = []
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                sub_directories.append(entry.path)
+            else:
+                files.append(entry.name)
+        return files, sub_directories
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            sub_directories.append(path)
+        else:
+            files.append(name)
+    return files, sub_directories
+
+# ------------------------------------------------------------------------------
+def clearCache():
+    "Forget every cached directory listing."
+    with _SCAN_CACHE_LOCK:
+        _SCAN_CACHE.clear()
@@ -24,13 +24,67 @@
 # ------------------------------------------------------------------------------
 
 
-import mari, os, hashlib
+import mari, os, hashlib, time, json, threading, Queue, fnmatch
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
+import udim_mapping, project_index, formatting
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 version = "0.05"
 
 USER_ROLE = 34          # PySide.Qt.UserRole
+PINNED_ROLE = 35        # PySide.Qt.UserRole + 1
+SCHEDULE_POLICIES = ['List Order', 'Current Object First', 'Smallest First']
+
+_CHANNEL_EXPORTED_CALLBACKS = []
+
+# Keys of an exportFromJobSpec job spec and their defaults, the defaults match the dialog
+JOB_SPEC_DEFAULTS = {
+'project' : None,
+'save_project' : False,
+'geos' : ['*'],
+'channels' : ['*'],
+'path' : None,
+'flattened' : True,
+'full_patch_bleed' : True,
+'small_textures' : False,
+'remove_alpha' : False,
+'only_modified_textures' : True,
+'hash_index' : False,
+'udim_batch_size' : 0,
+'deduplicate' : False,
+'trace' : False,
+'checkpoint' : False,
+'schedule' : 'List Order',
+'pinned' : [],
+'verify' : False,
+'udims' : None
+}
+HASH_INDEX_FILENAME = '.jtools_export_index.db'
+EXPORT_STATS_FILENAME = '.jtools_export_stats.json'
+EXPORT_TRACE_FILENAME = 'export_trace.jsonl'
+EXPORT_CHECKPOINT_FILENAME = '.jtools_export_checkpoint.jsonl'
+EXPORT_MANIFEST_FILENAME = 'export_manifest.json'
+VERIFY_THREAD_COUNT = 8
+
+# First bytes of a valid file for each format, formats without a signature are only checked for size
+FORMAT_SIGNATURES = {
+'tif' : ('II*\x00', 'MM\x00*', 'II+\x00', 'MM\x00+'),
+'tiff' : ('II*\x00', 'MM\x00*', 'II+\x00', 'MM\x00+'),
+'exr' : ('\x76\x2f\x31\x01',),
+'png' : ('\x89PNG\r\n\x1a\n',),
+'jpg' : ('\xff\xd8\xff',),
+'jpeg' : ('\xff\xd8\xff',),
+'psd' : ('8BPS',),
+'bmp' : ('BM',)
+}
+
+# Rough size of a written file compared to the raw pixel data, and the highest bit depth each format stores
+FORMAT_SIZE_RATIO = {'tif': 1.0, 'tiff': 1.0, 'tga': 1.0, 'psd': 1.0, 'bmp': 1.0, 'exr': 0.6, 'png': 0.6, 'jpg': 0.15, 'jpeg': 0.15}
+FORMAT_MAX_DEPTH = {'tga': 8, 'bmp': 8, 'jpg': 8, 'jpeg': 8, 'png': 16, 'psd': 16}
 
 # ------------------------------------------------------------------------------
 class ExportSelectedChannelsUI(QtGui.QDialog):
@@ -82,9 +136,12 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         middle_button_layout = QtGui.QVBoxLayout()
         self.add_button = QtGui.QPushButton("+")
         self.remove_button = QtGui.QPushButton("-")
+        self.pin_button = QtGui.QPushButton("Pin")
+        self.pin_button.setToolTip('Pin or unpin the selected channels, pinned channels are exported first')
         middle_button_layout.addStretch()
         middle_button_layout.addWidget(self.add_button)
         middle_button_layout.addWidget(self.remove_button)
+        middle_button_layout.addWidget(self.pin_button)
         middle_button_layout.addStretch()
         
         #Add wrapped QtGui.QListWidget with custom functions
@@ -112,6 +169,7 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         
         #Hook up add/remove buttons
         self.remove_button.clicked.connect(self.export_list._removeChannels)
+        self.pin_button.clicked.connect(self.export_list._togglePinned)
         self.add_button.clicked.connect(lambda: self.export_list._addChannels(self.channel_list))
 
         #Add widgets to top layout
@@ -167,6 +225,25 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         self.export_only_modified_textures_box = QtGui.QCheckBox('Only Modified Textures')
         self.export_only_modified_textures_box.setChecked(True)
         middle_group_layout.addWidget(self.export_only_modified_textures_box)
+        self.export_hash_index_box = QtGui.QCheckBox('Use Hash Index File')
+        self.export_hash_index_box.setToolTip('Store modified texture hashes in "%s" next to the export path instead of channel metadata' %HASH_INDEX_FILENAME)
+        self.export_hash_index_box.setEnabled(sqlite3 is not None)
+        self.export_only_modified_textures_box.toggled.connect(lambda checked: self.export_hash_index_box.setEnabled(checked and sqlite3 is not None))
+        middle_group_layout.addWidget(self.export_hash_index_box)
+        self.export_checkpoint_box = QtGui.QCheckBox('Resume Interrupted Export')
+        self.export_checkpoint_box.setToolTip('Record finished channels and UDIMs in "%s" next to the export path, '
+            'an export with the same settings carries on from where an interrupted one stopped. Without Only Modified Textures '
+            'channels painted since the interrupted export are not exported again' %EXPORT_CHECKPOINT_FILENAME)
+        self.export_checkpoint_box.setChecked(False)
+        middle_group_layout.addWidget(self.export_checkpoint_box)
+        middle_group_layout.addStretch()
+        batch_size_label = QtGui.QLabel('UDIMs Per Job:')
+        self.export_batch_size_box = QtGui.QSpinBox()
+        self.export_batch_size_box.setRange(0, 10000)
+        self.export_batch_size_box.setSpecialValueText('All')
+        self.export_batch_size_box.setToolTip('Split each channel export into batches of this many UDIMs, the export can be cancelled between batches')
+        middle_group_layout.addWidget(batch_size_label)
+        middle_group_layout.addWidget(self.export_batch_size_box)
         middle_group.setLayout(middle_group_layout)
 
         #Add check box layout.
@@ -176,11 +253,21 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         self.export_flattened_box = QtGui.QCheckBox('Export Flattened')
         self.export_full_patch_bleed_box = QtGui.QCheckBox('Full Patch Bleed')
         self.export_small_textures_box = QtGui.QCheckBox('Disable Small Textures')
+        self.export_deduplicate_box = QtGui.QCheckBox('Link Identical Files')
+        self.export_deduplicate_box.setToolTip('After exporting, replace exported files that are identical to another exported file with hard links, '
+            'linked files are unlinked before they are exported again')
+        self.export_deduplicate_box.setEnabled(hasattr(os, 'link'))
+        self.export_trace_box = QtGui.QCheckBox('Write Export Trace')
+        self.export_trace_box.setToolTip('Append per channel timings to "%s" next to the export path' %EXPORT_TRACE_FILENAME)
+        self.export_verify_box = QtGui.QCheckBox('Verify Exported Files')
+        self.export_verify_box.setToolTip('Check every exported file while the export runs and write "%s" next to the export path' %EXPORT_MANIFEST_FILENAME)
         if self.bool_:
             self.export_remove_alpha_box = QtGui.QCheckBox('Remove Alpha')
     
         #Add tick boxes and buttons to bottom layout
         check_box_layout.addWidget(self.export_flattened_box, 0, 0)
+        check_box_layout.addWidget(self.export_deduplicate_box, 0, 1)
+        check_box_layout.addWidget(self.export_trace_box, 0, 2)
         check_box_layout.addWidget(self.export_full_patch_bleed_box, 1, 0)
         check_box_layout.addWidget(self.export_small_textures_box, 1, 1)
         if self.bool_:
@@ -191,6 +278,15 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         self.export_full_patch_bleed_box.setChecked(True)
         self.export_remove_alpha_box.setChecked(False)
 
+        #Add export order combo box
+        schedule_label = QtGui.QLabel('Export Order:')
+        self.export_schedule_combo = QtGui.QComboBox()
+        self.export_schedule_combo.addItems(SCHEDULE_POLICIES)
+        self.export_schedule_combo.setToolTip('Order channels are exported in, pinned channels always go first')
+        check_box_layout.addWidget(schedule_label, 2, 0)
+        check_box_layout.addWidget(self.export_schedule_combo, 2, 1)
+        check_box_layout.addWidget(self.export_verify_box, 2, 2)
+
         bottom_group.setLayout(check_box_layout)
 
         #Add widget groups to main layout
@@ -204,6 +300,9 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         self.button_box.setStandardButtons(QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel)
         self.button_box.button(QtGui.QDialogButtonBox.Ok).clicked.connect(self._checkInput)
         self.button_box.button(QtGui.QDialogButtonBox.Cancel).clicked.connect(self.reject)
+        plan_button = self.button_box.addButton('Plan Export', QtGui.QDialogButtonBox.ActionRole)
+        plan_button.setToolTip('Work out which UDIMs would be exported and how big they would be, without exporting anything')
+        plan_button.clicked.connect(self._planExport)
 
         #Add bottom layout to main layout and set main layout to dialog's layout
         main_layout.addWidget(self.button_box)
@@ -268,6 +367,7 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
         self.export_list.setHidden(_bool)
         self.add_button.setHidden(_bool)
         self.remove_button.setHidden(_bool)
+        self.pin_button.setHidden(_bool)
     
     #Get the path from existing directory
     def _getPath(self):
@@ -303,6 +403,47 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
             return
         self.accept()
 
+    #Work out and report the export plan without exporting anything
+    def _planExport(self):
+        if not self.export_everything_box.isChecked() and len(self.export_list._currentChannels()) == 0:
+            mari.utils.message("Please add a channel to export.")
+            return
+        args_dict = self._getArgsDict()
+        if args_dict['everything']:
+            channels = _allChannels()
+        else:
+            channels = args_dict['channels']
+        try:
+            plan = _planExport(channels, args_dict)
+        except ExportError, e:
+            mari.utils.message(str(e))
+            return
+        if plan is None:
+            return
+        _showExportPlan(plan, args_dict['path'])
+
+    #Get the export arguments from the dialog (dict)
+    def _getArgsDict(self):
+        return {
+        'channels' : self._getChannelsToExport(),
+        'everything' : self._getExportEverything(),
+        'path' : self._getExportPathTemplate(),
+        'flattened' : self._getExportFlattened(),
+        'full_patch_bleed' : self._getExportFullPatchBleed(),
+        'small_textures' : self._getExportSmallTextures(),
+        'remove_alpha' : self._getExportRemoveAlpha(),
+        'only_modified_textures' : self._getExportOnlyModifiedTextures(),
+        'hash_index' : self._getExportHashIndex(),
+        'udim_batch_size' : self._getExportBatchSize(),
+        'deduplicate' : self._getExportDeduplicate(),
+        'trace' : self._getExportTrace(),
+        'checkpoint' : self._getExportCheckpoint(),
+        'schedule' : self._getExportSchedule(),
+        'pinned' : self.export_list._pinnedChannels(),
+        'verify' : self._getExportVerify(),
+        'udims' : None
+        }
+
     #Get list of channels to export from the export list
     def _getChannelsToExport(self):
         return self.export_list._currentChannels()
@@ -319,6 +460,22 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
     def _getExportOnlyModifiedTextures(self):
         return self.export_only_modified_textures_box.isChecked()
 
+    #Get export hash index box is ticked (bool)
+    def _getExportHashIndex(self):
+        return self.export_hash_index_box.isEnabled() and self.export_hash_index_box.isChecked()
+
+    #Get the export order policy (str)
+    def _getExportSchedule(self):
+        return self.export_schedule_combo.currentText()
+
+    #Get resume interrupted export box is ticked (bool)
+    def _getExportCheckpoint(self):
+        return self.export_checkpoint_box.isChecked()
+
+    #Get the number of UDIMs to export per job, 0 exports each channel in one job (int)
+    def _getExportBatchSize(self):
+        return self.export_batch_size_box.value()
+
     #Get export flattened box is ticked (bool)
     def _getExportFlattened(self):
         return self.export_flattened_box.isChecked()
@@ -331,6 +488,18 @@ class ExportSelectedChannelsUI(QtGui.QDialog):
     def _getExportSmallTextures(self):
         return self.export_small_textures_box.isChecked()
 
+    #Get verify exported files box is ticked (bool)
+    def _getExportVerify(self):
+        return self.export_verify_box.isChecked()
+
+    #Get write export trace box is ticked (bool)
+    def _getExportTrace(self):
+        return self.export_trace_box.isChecked()
+
+    #Get link identical files box is ticked (bool)
+    def _getExportDeduplicate(self):
+        return self.export_deduplicate_box.isEnabled() and self.export_deduplicate_box.isChecked()
+
     #Get export remove alpha box is ticked (bool)
     def _getExportRemoveAlpha(self):
         if self.bool_:
@@ -366,6 +535,18 @@ class ChannelsToExportList(QtGui.QListWidget):
                 self.addItem(item.text())
                 self.item(self.count() - 1).setData(USER_ROLE, channel)
         
+    def _pinnedChannels(self):
+        return [self.item(index).data(USER_ROLE) for index in range(self.count()) if self.item(index).data(PINNED_ROLE)]
+
+    def _togglePinned(self):
+        "Pins or unpins the selected channels, pinned channels are shown in bold."
+        for item in self.selectedItems():
+            pinned = not item.data(PINNED_ROLE)
+            item.setData(PINNED_ROLE, pinned)
+            font = item.font()
+            font.setBold(pinned)
+            item.setFont(font)
+
     def _removeChannels(self):
         "Removes any currently selected operations."
         for item in reversed(self.selectedItems()):     # reverse so indices aren't modified
@@ -431,61 +612,792 @@ class InfoUI(QtGui.QMessageBox):
 
 # ------------------------------------------------------------------------------ 
 def _exportChannels(args_dict):
-    save_options = 0
-    if args_dict['full_patch_bleed']:
-        save_options = save_options|2
-    elif args_dict['small_textures']:
-        save_options = save_options|1
-    elif args_dict['remove_alpha']:
-        save_options = save_options|4
-    #Check if export flattened is ticked, if not export unflattened
-    path = args_dict['path']
-    if args_dict['flattened']:
-        for channel in args_dict['channels']:
-            uv_index_list = []
-            metadata = []
-            if args_dict['only_modified_textures']:
-                uv_index_list, metadata = _onlyModifiedTextures(channel)
-                if len(uv_index_list) == 0:
-                    continue
+    """Export the channels in the export list"""
+    _exportChannelList(args_dict['channels'], args_dict)
+    
+# ------------------------------------------------------------------------------ 
+def _exportEverything(args_dict):
+    """Export everything, all geo and all channels"""
+    _exportChannelList(_allChannels(), args_dict)
+
+# ------------------------------------------------------------------------------ 
+def _allChannels():
+    """Returns every channel of every geo"""
+    return project_index.ProjectIndex().channels()
+
+# ------------------------------------------------------------------------------ 
+def _exportChannelList(channels, args_dict):
+    """Export channels, if only modified textures is ticked only export patches that have changed"""
+    try:
+        queue = _runExport(channels, args_dict)
+        _commitHashIndex(queue.hash_index)
+    except ExportError, e:
+        mari.utils.message(str(e))
+        return
+    _showExportSummary(queue)
+
+# ------------------------------------------------------------------------------ 
+class ExportError(Exception):
+    """Raised when an export can't start or its hash index can't be stored."""
+    pass
+
+# ------------------------------------------------------------------------------ 
+def _runExport(channels, args_dict):
+    """Export channels through an export queue without any dialogs, returns the finished queue.
+    The hash index is left for the caller to commit."""
+    hash_index = _readHashIndex(args_dict)
+    queue = ExportQueue(args_dict, hash_index)
+    for channel in channels:
+        queue.add(channel)
+    if args_dict['checkpoint']:
+        queue.checkpoint = ExportCheckpoint(args_dict['path'], _settingsHash(channels, args_dict))
+        queue.checkpoint.read()
+        queue.checkpoint.restoreHashes(hash_index)
+    if args_dict['verify']:
+        if _hasUnknownTokens(args_dict['path']):
+            mari.app.log('Export files can only be verified for $ENTITY, $CHANNEL and $UDIM path templates')
+        else:
+            queue.verifier = ExportVerifier()
+    queue.run()
+    if queue.verifier is not None:
+        queue.verifier.finish()
+        queue.verifier.writeManifest(os.path.join(os.path.split(args_dict['path'])[0], EXPORT_MANIFEST_FILENAME))
+    _recordExportStats(args_dict['path'], queue)
+    if args_dict['deduplicate']:
+        queue.deduplicate()
+    return queue
+
+# ------------------------------------------------------------------------------ 
+class ExportJob(object):
+    """A channel to export, split into batches of uv indexes when it runs."""
+    def __init__(self, channel):
+        self.channel = channel
+        self.uv_indexes_exported = 0
+        self.uv_indexes_skipped = 0
+        self.bytes_estimated = 0
+        self.bytes_written = 0
+        self.files = []
+        self.hash_seconds = 0.0
+        self.export_seconds = 0.0
+        self.metadata_seconds = 0.0
+        self.elapsed = 0.0
+        self.error = None
+        self.cancelled = False
+
+    def name(self):
+        return '%s : %s' %(self.channel.geoEntity().name(), self.channel.name())
+
+    def record(self):
+        "Returns the job timings and counts as a dict."
+        return {
+        'geo' : self.channel.geoEntity().name(),
+        'channel' : self.channel.name(),
+        'hash_seconds' : self.hash_seconds,
+        'export_seconds' : self.export_seconds,
+        'metadata_seconds' : self.metadata_seconds,
+        'seconds' : self.elapsed,
+        'udims_exported' : self.uv_indexes_exported,
+        'udims_skipped' : self.uv_indexes_skipped,
+        'bytes_written' : self.bytes_written,
+        'error' : None if self.error is None else str(self.error)
+        }
+
+# ------------------------------------------------------------------------------ 
+class ExportQueue(object):
+    """Runs export jobs one at a time, processing Qt events between jobs and batches so Mari stays responsive.
+    Failed jobs are collected and the remaining jobs carry on, the queue can be cancelled from the progress bar."""
+    def __init__(self, args_dict, hash_index=None):
+        self.args_dict = args_dict
+        self.hash_index = hash_index
+        self.save_options = _saveOptions(args_dict)
+        self.batch_size = args_dict['udim_batch_size']
+        self.jobs = []
+        self.exported = []
+        self.skipped = []
+        self.failed = []
+        self.resumed = []
+        self.checkpoint = None
+        self.verifier = None
+        self.cancelled = False
+        self.elapsed = 0.0
+        self.files_linked = 0
+        self.bytes_saved = 0
+        self.run_id = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.trace_path = None
+        if args_dict['trace']:
+            self.trace_path = os.path.join(os.path.split(args_dict['path'])[0], EXPORT_TRACE_FILENAME)
+
+    def add(self, channel):
+        "Add a channel export job to the queue."
+        self.jobs.append(ExportJob(channel))
+
+    def run(self):
+        "Run every job in the queue, returns False if the queue was cancelled."
+        self.jobs = _scheduleJobs(self.jobs, self.args_dict)
+        start = time.time()
+        mari.app.startProcessing('Exporting channels...', len(self.jobs), can_cancel=True)
+        try:
+            for job in self.jobs:
+                if self._wasCancelled():
+                    break
+                self._runJob(job)
+                mari.app.stepProgress()
+                QtGui.QApplication.processEvents()
+        finally:
+            mari.app.stopProcessing()
+            self.elapsed = time.time() - start
+        if self.checkpoint is not None and not self.failed and not self.cancelled:
+            self.checkpoint.remove()
+        return not self.cancelled
+
+    def uvIndexesExported(self):
+        "Returns the number of patch images exported by all jobs."
+        return sum([job.uv_indexes_exported for job in self.exported])
+
+    def exportedFiles(self):
+        "Returns the paths of every file written, including the finished batches of failed jobs."
+        files = []
+        for job in self.jobs:
+            files.extend(job.files)
+        return files
+
+    def deduplicate(self):
+        "Replace written files that are identical to another written file with hard links."
+        self.files_linked, self.bytes_saved = _deduplicateFiles(self.exportedFiles())
+
+    def _wasCancelled(self):
+        if not self.cancelled and mari.app.wasProcessingCancelled():
+            self.cancelled = True
+        return self.cancelled
+
+    def _runJob(self, job):
+        #With only modified textures a finished channel is hashed again so paint added since the checkpoint is exported
+        if self.checkpoint is not None and not self.args_dict['only_modified_textures'] and self.checkpoint.isChannelComplete(job.channel):
+            self.resumed.append(job)
+            return
+        start = time.time()
+        exported = False
+        try:
+            exported = self._exportJob(job)
+        except Exception, e:
+            job.error = e
+        job.elapsed = time.time() - start
+        job.bytes_written = sum([os.path.getsize(path) for path in job.files if os.path.isfile(path)])
+        if job.error is not None:
+            self.failed.append(job)
+            mari.app.log('Failed to export %s "%s"' %(job.name(), job.error))
+        elif exported:
+            self.exported.append(job)
+            mari.app.log('Exported %s, %d patches in %.1fs' %(job.name(), job.uv_indexes_exported, job.elapsed))
+        elif job.cancelled:
+            mari.app.log('Cancelled %s before it was exported' %job.name())
+        else:
+            self.skipped.append(job)
+        if self.checkpoint is not None and job.error is None and not self.cancelled:
+            self.checkpoint.completeChannel(job.channel)
+        self._trace(job)
+        _notifyChannelExported(job)
+
+    def _exportJob(self, job):
+        "Export the job's channel in batches, returns False if nothing needed exporting or it was cancelled before the first batch."
+        uv_index_list = []
+        metadata = []
+        if self.args_dict['only_modified_textures']:
+            hash_start = time.time()
+            uv_index_list, metadata = _onlyModifiedTextures(job.channel, self.hash_index)
+            job.hash_seconds = time.time() - hash_start
+            job.uv_indexes_skipped = len(job.channel.geoEntity().patchList()) - len(uv_index_list)
+            if len(uv_index_list) == 0:
+                return False
+        if self.args_dict['udims']:
+            selected_list, metadata = _selectUvIndexes(job.channel, self.args_dict['udims'], uv_index_list, metadata)
+            job.uv_indexes_skipped += len(uv_index_list or job.channel.geoEntity().patchList()) - len(selected_list)
+            uv_index_list = selected_list
+            if len(uv_index_list) == 0:
+                return False
+        if self.checkpoint is not None:
+            uv_index_list, metadata = self.checkpoint.remainingUvIndexes(job.channel, uv_index_list, metadata)
+            if uv_index_list is None:
+                return False
+        for batch, batch_metadata in self._batches(job.channel, uv_index_list, metadata):
+            if self._wasCancelled():
+                if job.uv_indexes_exported == 0:
+                    job.cancelled = True
+                    return False
+                break
+            export_start = time.time()
+            _exportImages(job.channel, self.args_dict['path'], self.save_options, batch, self.args_dict['flattened'])
+            metadata_start = time.time()
+            _storeHashes(job.channel, batch_metadata, self.hash_index)
+            job.export_seconds += metadata_start - export_start
+            job.metadata_seconds += time.time() - metadata_start
+            exported = batch or [patch.uvIndex() for patch in job.channel.geoEntity().patchList()]
+            job.uv_indexes_exported += len(exported)
+            for uv_index in exported:
+                path = _exportFilePath(self.args_dict['path'], job.channel, uv_index)
+                job.files.append(path)
+                if self.verifier is not None:
+                    self.verifier.add(path, job.channel, uv_index)
+            job.bytes_estimated += sum([_estimateFileBytes(job.channel, uv_index, self.args_dict) for uv_index in exported])
+            if self.checkpoint is not None:
+                self.checkpoint.addUnit(job.channel, exported, batch_metadata)
+            QtGui.QApplication.processEvents()
+        return True
+
+    def _trace(self, job):
+        "Append the job record to the trace file as a JSON line."
+        if self.trace_path is None:
+            return
+        record = job.record()
+        record['run'] = self.run_id
+        try:
+            with open(self.trace_path, 'a') as file_:
+                file_.write(json.dumps(record, sort_keys=True) + '\n')
+        except (IOError, OSError), e:
+            mari.app.log('Failed to write export trace "%s"' %e)
+            self.trace_path = None
+
+    def _batches(self, channel, uv_index_list, metadata):
+        "Returns a list of (uv indexes, metadata) batches, an empty uv index list exports every patch."
+        if self.batch_size <= 0:
+            return [(uv_index_list, metadata)]
+        if len(uv_index_list) == 0:
+            uv_index_list = sorted([patch.uvIndex() for patch in channel.geoEntity().patchList()])
+        batches = []
+        for start in range(0, len(uv_index_list), self.batch_size):
+            end = start + self.batch_size
+            batches.append((uv_index_list[start:end], metadata[start:end]))
+        return batches
+
+# ------------------------------------------------------------------------------ 
+def _scheduleJobs(jobs, args_dict):
+    """Returns the jobs in the order they should run, pinned channels first then by the export order policy"""
+    policy = args_dict['schedule']
+    pinned = set(args_dict['pinned'])
+    if policy == 'Current Object First':
+        current_geo = mari.geo.current()
+        key = lambda job: (job.channel not in pinned, job.channel.geoEntity() is not current_geo)
+    elif policy == 'Smallest First':
+        key = lambda job: (job.channel not in pinned, _estimateChannelBytes(job.channel, args_dict))
+    else:
+        key = lambda job: job.channel not in pinned
+    return sorted(jobs, key=key)
+
+# ------------------------------------------------------------------------------ 
+def _estimateChannelBytes(channel, args_dict):
+    """Estimate the size of every patch file of the channel, used to order exports"""
+    return sum([_estimateFileBytes(channel, patch.uvIndex(), args_dict) for patch in channel.geoEntity().patchList()])
+
+# ------------------------------------------------------------------------------ 
+def addChannelExportedCallback(callback):
+    """Call callback(channel, record) each time a channel export job finishes, record is the job's timings and counts
+    and has an error if the channel failed. Lets publish scripts or look-dev reloads start on channels as they finish."""
+    if callback not in _CHANNEL_EXPORTED_CALLBACKS:
+        _CHANNEL_EXPORTED_CALLBACKS.append(callback)
+
+# ------------------------------------------------------------------------------ 
+def removeChannelExportedCallback(callback):
+    """Stop calling a callback added with addChannelExportedCallback"""
+    if callback in _CHANNEL_EXPORTED_CALLBACKS:
+        _CHANNEL_EXPORTED_CALLBACKS.remove(callback)
+
+# ------------------------------------------------------------------------------ 
+def _notifyChannelExported(job):
+    """Call the channel exported callbacks, a failing callback is logged and doesn't stop the export"""
+    if not _CHANNEL_EXPORTED_CALLBACKS:
+        return
+    record = job.record()
+    for callback in list(_CHANNEL_EXPORTED_CALLBACKS):
+        try:
+            callback(job.channel, record)
+        except Exception, e:
+            mari.app.log('Channel exported callback failed "%s"' %e)
+
+# ------------------------------------------------------------------------------ 
+class ExportCheckpoint(object):
+    """State file next to the export path recording the finished (geo, channel, uv indexes) units of an export,
+    so an interrupted export with the same settings can skip them. The first line stamps the settings and time,
+    each finished batch or channel appends one JSON line so long exports don't rewrite the file. A recorded UDIM
+    whose hash has changed since is exported again. It is removed once an export finishes cleanly."""
+    def __init__(self, path_template, settings_hash):
+        self.path = os.path.join(os.path.split(path_template)[0], EXPORT_CHECKPOINT_FILENAME)
+        self.settings_hash = settings_hash
+        self.created = None
+        self.channels = set()
+        self.units = []
+
+    def read(self):
+        "Read the checkpoint, returns True if it was left by an export with the same settings."
+        self.created = None
+        self.channels = set()
+        self.units = []
+        try:
+            with open(self.path, 'r') as file_:
+                lines = file_.readlines()
+        except (IOError, OSError):
+            return False
+        records = []
+        for line in lines:
             try:
-                channel.exportImagesFlattened(path, save_options, uv_index_list)
-            except Exception, e:
-                mari.utils.message('Failed to export "%s"' %e)
+                records.append(json.loads(line))
+            except ValueError:
+                #A line cut off by a crash ends the checkpoint
+                break
+        if not records or not records[0].get('settings') == self.settings_hash:
+            return False
+        self.created = records[0].get('created')
+        for record in records[1:]:
+            if 'channel' in record:
+                self.channels.add(tuple(record['channel']))
+            elif 'unit' in record:
+                self.units.append(record['unit'])
+        return True
+
+    def isChannelComplete(self, channel):
+        "Returns True if every patch of the channel has been exported."
+        return _channelKey(channel) in self.channels
+
+    def remainingUvIndexes(self, channel, uv_index_list, metadata):
+        "Returns the uv indexes and metadata not yet exported or changed since they were, None if everything has been exported."
+        done = {}
+        key = list(_channelKey(channel))
+        for unit in self.units:
+            if unit[:2] == key:
+                for index, uv_index in enumerate(unit[2]):
+                    done[uv_index] = unit[3][index] if index < len(unit[3]) else None
+        if not done:
+            return uv_index_list, metadata
+        if len(uv_index_list) == 0:
+            uv_index_list = sorted([patch.uvIndex() for patch in channel.geoEntity().patchList()])
+        remaining = []
+        for index, uv_index in enumerate(uv_index_list):
+            if uv_index not in done:
+                remaining.append(index)
+            elif index < len(metadata) and done[uv_index] is not None and list(metadata[index]) != done[uv_index]:
+                remaining.append(index)
+        if len(remaining) == 0:
+            return None, []
+        return [uv_index_list[index] for index in remaining], [metadata[index] for index in remaining if index < len(metadata)]
+
+    def addUnit(self, channel, uv_index_list, metadata):
+        "Record exported uv indexes of a channel, with their hashes so they can be restored on resume."
+        unit = list(_channelKey(channel)) + [list(uv_index_list), [list(data) for data in metadata]]
+        self.units.append(unit)
+        self._append({'unit' : unit})
+
+    def completeChannel(self, channel):
+        "Record that every patch of the channel has been exported."
+        self.channels.add(_channelKey(channel))
+        self._append({'channel' : list(_channelKey(channel))})
+
+    def restoreHashes(self, hash_index):
+        "Put the hashes of the finished units back into the hash index, they were not committed when the export stopped."
+        if hash_index is None:
+            return
+        channels = dict([(_channelKey(channel), channel) for channel in _allChannels()])
+        for geo, channel, uv_index_list, metadata in self.units:
+            if (geo, channel) in channels:
+                hash_index.update(channels[(geo, channel)], metadata)
+
+    def _append(self, record):
+        "Append a record, a new checkpoint starts with the settings and time it was created."
+        try:
+            if self.created is None:
+                self.created = time.strftime('%Y-%m-%d %H:%M:%S')
+                with open(self.path, 'w') as file_:
+                    file_.write(json.dumps({'settings' : self.settings_hash, 'created' : self.created}) + '\n')
+            with open(self.path, 'a') as file_:
+                file_.write(json.dumps(record, sort_keys=True) + '\n')
+        except (IOError, OSError), e:
+            mari.app.log('Failed to write export checkpoint "%s"' %e)
+
+    def remove(self):
+        "Remove the checkpoint once the export has finished."
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError, e:
+            mari.app.log('Failed to remove export checkpoint "%s"' %e)
+
+# ------------------------------------------------------------------------------ 
+def _settingsHash(channels, args_dict):
+    """Returns a hash of everything that decides what an export writes, used to match a checkpoint to an export"""
+    settings = dict([(key, args_dict[key]) for key in ('path', 'flattened', 'full_patch_bleed', 'small_textures', 'remove_alpha', 'only_modified_textures', 'udims')])
+    settings['project'] = mari.projects.current().uuid()
+    settings['channels'] = [list(_channelKey(channel)) for channel in channels]
+    return hashlib.sha256(json.dumps(settings, sort_keys=True)).hexdigest()
+
+# ------------------------------------------------------------------------------ 
+class ExportVerifier(object):
+    """Checks exported files on worker threads while the export carries on, each file must exist,
+    not be empty and start with a valid image header. The sha256 is taken in the same read."""
+    def __init__(self, thread_count=VERIFY_THREAD_COUNT):
+        self.results = []
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        for index in range(thread_count):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def add(self, path, channel, uv_index):
+        "Queue a file to verify, only the names are passed to the worker threads, not Mari objects."
+        self._queue.put({
+        'path' : path,
+        'geo' : channel.geoEntity().name(),
+        'channel' : channel.name(),
+        'udim' : uv_index + 1001
+        })
+
+    def finish(self):
+        "Wait for every queued file to be verified."
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.results.sort(key=lambda x: x['path'])
+
+    def badFiles(self):
+        "Returns the results of files that are missing or invalid."
+        return [result for result in self.results if result['error'] is not None]
+
+    def writeManifest(self, path):
+        "Write every verified file with its size, sha256, udim, channel and timestamp as JSON."
+        try:
+            _writeJson(path, {'created' : time.strftime('%Y-%m-%d %H:%M:%S'), 'files' : self.results})
+        except (IOError, OSError), e:
+            mari.app.log('Failed to write export manifest "%s"' %e)
+
+    def _work(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
                 return
-            for data in metadata:            
-                channel.setMetadata(*data)
-                channel.setMetadataEnabled(data[0], False)
-            channel.setMetadata('OnlyModifiedTextures', True)
-            channel.setMetadataEnabled('OnlyModifiedTextures', False)  
+            entry.update(_verifyFile(entry['path']))
+            with self._lock:
+                self.results.append(entry)
+
+# ------------------------------------------------------------------------------ 
+def _verifyFile(path, block_size=1024*1024):
+    """Returns the size, sha256, timestamp and error (None if the file is valid) of an exported file"""
+    result = {'size' : 0, 'sha256' : None, 'timestamp' : None, 'error' : None}
+    try:
+        stat = os.stat(path)
+        result['size'] = stat.st_size
+        result['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime))
+        if stat.st_size == 0:
+            result['error'] = 'File is empty'
+            return result
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as file_:
+            block = file_.read(block_size)
+            signatures = FORMAT_SIGNATURES.get(os.path.splitext(path)[1].lower().lstrip('.'))
+            if signatures is not None and not block.startswith(signatures):
+                result['error'] = 'Invalid image header'
+            while block:
+                sha256.update(block)
+                block = file_.read(block_size)
+        result['sha256'] = sha256.hexdigest()
+    except (IOError, OSError), e:
+        result['error'] = str(e)
+    return result
+
+# ------------------------------------------------------------------------------ 
+def _exportImages(channel, path, save_options, uv_index_list, flattened):
+    """Export the channel images, flattened or unflattened"""
+    _unlinkLinkedFiles(channel, path, uv_index_list)
+    if flattened:
+        channel.exportImagesFlattened(path, save_options, uv_index_list)
     else:
-        for channel in args_dict['channels']:
-            uv_index_list = []
-            metadata = []
-            if args_dict['only_modified_textures']:
-                uv_index_list, metadata = _onlyModifiedTextures(channel)
-                if len(uv_index_list) == 0:
+        channel.exportImages(path, save_options, uv_index_list)
+
+# ------------------------------------------------------------------------------ 
+def _unlinkLinkedFiles(channel, path_template, uv_index_list):
+    """Remove export files that are hard linked to other files before Mari writes over them in place,
+    otherwise the new image would also change every file linked to it"""
+    if _hasUnknownTokens(path_template):
+        return
+    if len(uv_index_list) == 0:
+        uv_index_list = [patch.uvIndex() for patch in channel.geoEntity().patchList()]
+    for uv_index in uv_index_list:
+        path = _exportFilePath(path_template, channel, uv_index)
+        try:
+            if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except OSError, e:
+            mari.app.log('Failed to unlink "%s" before export "%s"' %(path, e))
+
+# ------------------------------------------------------------------------------ 
+def _deduplicateFiles(paths):
+    """Replace files that are byte identical to an earlier file in the list with hard links to it, run as a
+    separate pass after the export. Exports remove linked files before writing so a re-exported file never
+    changes the files linked to it. Only files of the same size are hashed, returns (files linked, bytes saved).
+    Files that can't be read are logged and left as they are."""
+    same_size = {}
+    for path in paths:
+        try:
+            same_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError:
+            continue
+    candidates = [group for group in same_size.values() if len(group) > 1]
+    files_linked = 0
+    bytes_saved = 0
+    mari.app.startProcessing('Linking identical files...', len(candidates), can_cancel=True)
+    try:
+        for group in candidates:
+            if mari.app.wasProcessingCancelled():
+                break
+            originals = {}
+            for path in group:
+                try:
+                    original = originals.setdefault(_fileDigest(path), path)
+                    if original == path or os.path.samefile(original, path):
+                        continue
+                    size = os.path.getsize(path)
+                except (IOError, OSError), e:
+                    mari.app.log('Failed to compare "%s" with identical files "%s"' %(path, e))
                     continue
-            try:
-                channel.exportImages(path, save_options, uv_index_list)
-            except Exception, e:
-                mari.utils.message('Failed to export "%s"' %e)
-                return
-            for data in metadata:            
-                channel.setMetadata(*data)
-                channel.setMetadataEnabled(data[0], False)
-            channel.setMetadata('OnlyModifiedTextures', True)
-            channel.setMetadataEnabled('OnlyModifiedTextures', False)        
+                if _replaceWithLink(original, path):
+                    files_linked += 1
+                    bytes_saved += size
+            mari.app.stepProgress()
+            QtGui.QApplication.processEvents()
+    finally:
+        mari.app.stopProcessing()
+    return files_linked, bytes_saved
+
+# ------------------------------------------------------------------------------ 
+def _fileDigest(path, block_size=1024*1024):
+    """Returns the sha256 of a file, read in blocks"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file_:
+        block = file_.read(block_size)
+        while block:
+            sha256.update(block)
+            block = file_.read(block_size)
+    return sha256.hexdigest()
+
+# ------------------------------------------------------------------------------ 
+def _replaceWithLink(original, path):
+    """Replace the file at path with a hard link to original, returns False if it couldn't be linked"""
+    temp_path = path + '.jtools_link'
+    try:
+        os.link(original, temp_path)
+        os.rename(temp_path, path)
+    except OSError, e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        mari.app.log('Failed to link "%s" to "%s" "%s"' %(path, original, e))
+        return False
+    return True
+
+# ------------------------------------------------------------------------------ 
+def _showExportSummary(queue):
+    """Let the user know how the export went, listing any failed channels"""
+    uv_indexes = queue.uvIndexesExported()
+    rate = 0.0
+    if queue.elapsed > 0:
+        rate = uv_indexes / queue.elapsed
+    info = 'Exported %d channels (%d patches) in %.1fs, %.2f patches/s. %d channels were unchanged.' \
+    %(len(queue.exported), uv_indexes, queue.elapsed, rate, len(queue.skipped))
+    if queue.resumed:
+        info += ' %d channels were already exported by the interrupted export.' %len(queue.resumed)
+    if queue.files_linked:
+        info += ' Linked %d identical files, saving %s.' %(queue.files_linked, formatting.formatBytes(queue.bytes_saved))
+    table = _traceTable(queue.jobs)
+    if queue.verifier is not None:
+        bad_files = queue.verifier.badFiles()
+        info += ' Verified %d files, %d missing or invalid.' %(len(queue.verifier.results), len(bad_files))
+        if bad_files:
+            table = '\n'.join(['%s : %s' %(result['path'], result['error']) for result in bad_files] + ['', table])
+    mari.app.log(table)
+    if queue.failed or queue.cancelled or (queue.verifier is not None and queue.verifier.badFiles()):
+        title = 'Export Incomplete'
+        text = 'Export cancelled.' if queue.cancelled else 'Export finished with errors.'
+        if not queue.failed and not queue.cancelled:
+            text = 'Some exported files are missing or invalid.'
+        details = table
+        if queue.failed:
+            text = '%s %d channels failed to export.' %(text, len(queue.failed))
+            details = '\n'.join(['%s : %s' %(job.name(), job.error) for job in queue.failed] + ['', table])
+        InfoUI(title, text, info, details, bool_=True).exec_()
+        return
     #If successful let the user know
-    mari.utils.message("Export Successful")
-    
+    InfoUI('Export Successful', 'Export Successful', info, table, bool_=True).exec_()
+
 # ------------------------------------------------------------------------------ 
-def _exportEverything(args_dict):
-    """Export everything, all geo and all channels"""
-    geo_list = mari.geo.list()
-    channels = []
-    for geo in geo_list:
-        channels.extend(geo.channelList())
+def _traceTable(jobs):
+    """Returns a table of job timings, slowest channels first"""
+    rows = ['%-40s %9s %9s %9s %9s %8s %8s %10s' %('Channel', 'Total', 'Hash', 'Export', 'Metadata', 'Exported', 'Skipped', 'Written')]
+    for job in sorted(jobs, key=lambda x: x.elapsed, reverse=True):
+        rows.append('%-40s %8.1fs %8.1fs %8.1fs %8.1fs %8d %8d %10s' %(
+            job.name()[:40], job.elapsed, job.hash_seconds, job.export_seconds, job.metadata_seconds,
+            job.uv_indexes_exported, job.uv_indexes_skipped, formatting.formatBytes(job.bytes_written)
+            ))
+    return '\n'.join(rows)
+
+# ------------------------------------------------------------------------------ 
+def _planExport(channels, args_dict):
+    """Work out which patches each channel would export and how big they would be without exporting anything.
+    Returns a plan dict that can be written as a JSON manifest, or None if it was cancelled."""
+    hash_index = _readHashIndex(args_dict)
+    seconds_per_byte = _readExportStats(args_dict['path'])
+    plan = {
+    'path' : args_dict['path'],
+    'created' : time.strftime('%Y-%m-%d %H:%M:%S'),
+    'settings' : dict([(key, value) for key, value in args_dict.items() if key not in ('channels', 'pinned')]),
+    'channels' : []
+    }
+    plan['settings']['pinned'] = [list(_channelKey(channel)) for channel in args_dict['pinned']]
+    mari.app.startProcessing('Planning export...', len(channels), can_cancel=True)
+    try:
+        for channel in channels:
+            if mari.app.wasProcessingCancelled():
+                return None
+            plan['channels'].append(_planChannel(channel, args_dict, hash_index, seconds_per_byte))
+            mari.app.stepProgress()
+            QtGui.QApplication.processEvents()
+    finally:
+        mari.app.stopProcessing()
+    plan['files'] = sum([len(channel_plan['files']) for channel_plan in plan['channels']])
+    plan['bytes'] = sum([channel_plan['bytes'] for channel_plan in plan['channels']])
+    plan['estimated_seconds'] = None
+    if seconds_per_byte is not None:
+        plan['estimated_seconds'] = plan['bytes'] * seconds_per_byte
+    return plan
+
+# ------------------------------------------------------------------------------ 
+def _planChannel(channel, args_dict, hash_index=None, seconds_per_byte=None):
+    """Returns the plan for a single channel, nothing is stored or exported"""
+    geo = channel.geoEntity()
+    if args_dict['only_modified_textures']:
+        uv_index_list = _onlyModifiedTextures(channel, hash_index)[0]
+    else:
+        uv_index_list = sorted([patch.uvIndex() for patch in geo.patchList()])
+    if args_dict['udims']:
+        uv_index_list = _selectUvIndexes(channel, args_dict['udims'], uv_index_list)[0]
+    files = []
+    for uv_index in uv_index_list:
+        files.append({
+        'udim' : uv_index + 1001,
+        'path' : _exportFilePath(args_dict['path'], channel, uv_index),
+        'bytes' : _estimateFileBytes(channel, uv_index, args_dict)
+        })
+    bytes_ = sum([file_['bytes'] for file_ in files])
+    estimated_seconds = None
+    if seconds_per_byte is not None:
+        estimated_seconds = bytes_ * seconds_per_byte
+    return {
+    'geo' : geo.name(),
+    'channel' : channel.name(),
+    'udims' : [file_['udim'] for file_ in files],
+    'files' : files,
+    'bytes' : bytes_,
+    'estimated_seconds' : estimated_seconds
+    }
+
+# ------------------------------------------------------------------------------ 
+def _showExportPlan(plan, path_template):
+    """Show the plan summary, largest channels first, and offer to save it as a JSON manifest"""
+    channel_plans = sorted(plan['channels'], key=lambda x: x['bytes'], reverse=True)
+    text = 'Export would write %d files from %d channels, about %s.' %(plan['files'], len([x for x in channel_plans if x['files']]), formatting.formatBytes(plan['bytes']))
+    if plan['estimated_seconds'] is None:
+        info = 'No previous exports to this path to estimate the time from. Save the plan as a JSON manifest?'
+    else:
+        info = 'Estimated export time %s. Save the plan as a JSON manifest?' %formatting.formatSeconds(plan['estimated_seconds'])
+    details = '\n'.join(['%s : %s, %d UDIMs, %s' %(x['geo'], x['channel'], len(x['udims']), formatting.formatBytes(x['bytes'])) for x in channel_plans if x['files']])
+    dialog = InfoUI('Export Plan', text, info, details or None)
+    if not dialog.exec_():
+        return
+    manifest_path = mari.utils.misc.getSaveFileName(
+        parent=None,
+        caption='Save Export Plan',
+        dir=os.path.split(path_template)[0],
+        filter='',
+        selected_filter=None,
+        options=0,
+        save_filename='export_plan.json'
+    )
+    if manifest_path == "":
+        return
+    try:
+        _writeJson(manifest_path, plan)
+    except (IOError, OSError), e:
+        mari.utils.message('Failed to write export plan "%s"' %e)
+
+# ------------------------------------------------------------------------------ 
+def _exportFilePath(path_template, channel, uv_index):
+    """Returns the file path the channel patch will be exported to"""
+    path = path_template.replace('$ENTITY', channel.geoEntity().name())
+    path = path.replace('$CHANNEL', channel.name())
+    return path.replace('$UDIM', str(uv_index + 1001))
+
+# ------------------------------------------------------------------------------ 
+def _hasUnknownTokens(path_template):
+    """Returns True if the path template has tokens other than $ENTITY, $CHANNEL and $UDIM"""
+    for token in ('$ENTITY', '$CHANNEL', '$UDIM'):
+        path_template = path_template.replace(token, '')
+    return '$' in path_template
+
+# ------------------------------------------------------------------------------ 
+def _estimateFileBytes(channel, uv_index, args_dict):
+    """Estimate the size of an exported patch file from the patch resolution, channel depth and file format"""
+    file_type = os.path.splitext(args_dict['path'])[1].lower().lstrip('.')
+    depth = min(channel.depth(), FORMAT_MAX_DEPTH.get(file_type, 32))
+    components = 4
+    if args_dict['remove_alpha']:
+        components = 3
+    pixels = channel.width(uv_index) * channel.height(uv_index)
+    return int(pixels * components * depth / 8 * FORMAT_SIZE_RATIO.get(file_type, 1.0))
+
+# ------------------------------------------------------------------------------ 
+def _readExportStats(path_template):
+    """Returns the seconds per byte of previous exports to the path, or None if there are no previous exports"""
+    stats_path = os.path.join(os.path.split(path_template)[0], EXPORT_STATS_FILENAME)
+    try:
+        stats = _readJson(stats_path)
+    except (IOError, OSError, ValueError):
+        return None
+    if not stats.get('bytes'):
+        return None
+    return float(stats['seconds']) / stats['bytes']
+
+# ------------------------------------------------------------------------------ 
+def _recordExportStats(path_template, queue):
+    """Add the export queue timings to the stats used to estimate export time, older runs count for less"""
+    bytes_ = sum([job.bytes_estimated for job in queue.exported])
+    if bytes_ == 0:
+        return
+    seconds = sum([job.elapsed for job in queue.exported])
+    stats_path = os.path.join(os.path.split(path_template)[0], EXPORT_STATS_FILENAME)
+    try:
+        stats = _readJson(stats_path)
+    except (IOError, OSError, ValueError):
+        stats = {'bytes' : 0, 'seconds' : 0.0}
+    stats = {'bytes' : stats['bytes'] / 2 + bytes_, 'seconds' : stats['seconds'] / 2 + seconds}
+    try:
+        _writeJson(stats_path, stats)
+    except (IOError, OSError), e:
+        mari.app.log('Failed to write export stats "%s"' %e)
+
+# ------------------------------------------------------------------------------ 
+def _readJson(path):
+    """Returns the data from a JSON file"""
+    with open(path, 'r') as file_:
+        return json.load(file_)
+
+# ------------------------------------------------------------------------------ 
+def _writeJson(path, data):
+    """Write data to a JSON file"""
+    with open(path, 'w') as file_:
+        json.dump(data, file_, indent=4, sort_keys=True)
+
+# ------------------------------------------------------------------------------ 
+def _saveOptions(args_dict):
+    """Returns the save options flags for the export arguments"""
     save_options = 0
     if args_dict['full_patch_bleed']:
         save_options = save_options|2
@@ -493,46 +1405,7 @@ def _exportEverything(args_dict):
         save_options = save_options|1
     elif args_dict['remove_alpha']:
         save_options = save_options|4
-    #Check if export flattened is ticked, if not export unflattened
-    path = args_dict['path']
-    if args_dict['flattened']:
-        for channel in channels:
-            uv_index_list = []
-            metadata = []
-            if args_dict['only_modified_textures']:
-                uv_index_list, metadata = _onlyModifiedTextures(channel)
-                if len(uv_index_list) == 0:
-                    continue
-            try:
-                channel.exportImagesFlattened(path, save_options, uv_index_list)
-            except Exception, e:
-                mari.utils.message('Failed to export "%s"' %e)
-                return
-            for data in metadata:            
-                channel.setMetadata(*data)
-                channel.setMetadataEnabled(data[0], False)
-            channel.setMetadata('OnlyModifiedTextures', True)
-            channel.setMetadataEnabled('OnlyModifiedTextures', False)
-    else:
-        for channel in channels:
-            uv_index_list = []
-            metadata = []
-            if agrs_dict['only_modified_textures']:
-                uv_index_list, metadata = _onlyModifiedTextures(channel)
-                if len(uv_index_list) == 0:
-                    continue
-            try:
-                channel.exportImages(path, save_options, uv_index_list)
-            except Exception, e:
-                mari.utils.message('Failed to export "%s"' %e)
-                return
-            for data in metadata:            
-                channel.setMetadata(*data)
-                channel.setMetadataEnabled(data[0], False)
-            channel.setMetadata('OnlyModifiedTextures', True)
-            channel.setMetadataEnabled('OnlyModifiedTextures', False)
-    #If successful let the user know
-    mari.utils.message("Export Successful")
+    return save_options
 
 # ------------------------------------------------------------------------------
 def exportSelectedChannels():
@@ -544,42 +1417,140 @@ def exportSelectedChannels():
     #Create dialog and execute accordingly
     dialog = ExportSelectedChannelsUI(suitable[1])
     if dialog.exec_():
-        args_dict = {
-        'channels' : dialog._getChannelsToExport(),
-        'path' : dialog._getExportPathTemplate(),
-        'flattened' : dialog._getExportFlattened(),
-        'full_patch_bleed' : dialog._getExportFullPatchBleed(),
-        'small_textures' : dialog._getExportSmallTextures(),
-        'remove_alpha' : dialog._getExportRemoveAlpha(),
-        'only_modified_textures' : dialog._getExportOnlyModifiedTextures()
-        }
-        if dialog._getExportEverything():
+        args_dict = dialog._getArgsDict()
+        if args_dict['everything']:
             _exportEverything(args_dict)
         else:
             _exportChannels(args_dict)
 
 # ------------------------------------------------------------------------------
-def _onlyModifiedTextures(channel):
+def exportFromJobSpec(job_spec):
+    """Export channels described by a job spec without any dialogs, for the Python console or terminal mode Mari.
+    job_spec is a dict, a JSON string or the path of a JSON file, see JOB_SPEC_DEFAULTS for the keys.
+    geos, channels and pinned are lists of names or glob patterns, udims is a UDIM selection e.g. "1001-1020,v3". Returns a result dict."""
+    start = time.time()
+    result = {'success' : False, 'error' : None, 'cancelled' : False, 'seconds' : 0.0,
+    'exported' : [], 'skipped' : [], 'failed' : [], 'resumed' : [], 'bad_files' : [], 'files_linked' : 0, 'bytes_saved' : 0}
+    try:
+        args_dict = _readJobSpec(job_spec)
+        if args_dict['project'] and not _isCurrentProject(args_dict['project']):
+            mari.projects.open(args_dict['project'])
+        if mari.projects.current() is None:
+            raise ExportError('No project is open.')
+        channels = _matchChannels(args_dict['geos'], args_dict['channels'])
+        if len(channels) == 0:
+            raise ExportError('No channels match the job spec.')
+        args_dict['channels'] = channels
+        args_dict['pinned'] = [channel for channel in channels if _matchesAny(channel.name(), args_dict['pinned'])]
+        directory = os.path.split(args_dict['path'])[0]
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        queue = _runExport(channels, args_dict)
+        result['cancelled'] = queue.cancelled
+        result['exported'] = [job.record() for job in queue.exported]
+        result['skipped'] = [job.name() for job in queue.skipped]
+        result['failed'] = [job.record() for job in queue.failed]
+        result['resumed'] = [job.name() for job in queue.resumed]
+        result['files_linked'] = queue.files_linked
+        result['bytes_saved'] = queue.bytes_saved
+        if queue.verifier is not None:
+            result['bad_files'] = queue.verifier.badFiles()
+        _commitHashIndex(queue.hash_index)
+        if args_dict['save_project']:
+            mari.projects.current().save()
+        result['success'] = not (queue.failed or queue.cancelled or result['bad_files'])
+    except Exception, e:
+        #Mari raises its own exceptions from opening, exporting and saving, the result is returned whatever went wrong
+        result['error'] = str(e)
+        mari.app.log('Export from job spec failed "%s"' %e)
+    result['seconds'] = time.time() - start
+    return result
+
+# ------------------------------------------------------------------------------
+def _readJobSpec(job_spec):
+    """Returns the export arguments for a job spec dict, JSON string or JSON file path, filled in with the defaults"""
+    if isinstance(job_spec, basestring):
+        if os.path.isfile(job_spec):
+            job_spec = _readJson(job_spec)
+        else:
+            job_spec = json.loads(job_spec)
+    unknown = [key for key in job_spec if key not in JOB_SPEC_DEFAULTS]
+    if unknown:
+        raise ValueError('Unknown job spec keys: %s' %', '.join(sorted(unknown)))
+    if not job_spec.get('path'):
+        raise ValueError('The job spec needs an export path template.')
+    file_types = ['.' + format for format in mari.images.supportedWriteFormats()]
+    if not job_spec['path'].endswith(tuple(file_types)):
+        raise ValueError("File type is not supported: '%s'" %(os.path.split(job_spec['path'])[1]))
+    if job_spec.get('udims'):
+        udim_mapping.parseSelection(job_spec['udims'])
+    args_dict = dict(JOB_SPEC_DEFAULTS)
+    args_dict.update(job_spec)
+    args_dict['everything'] = False
+    return args_dict
+
+# ------------------------------------------------------------------------------
+def _selectUvIndexes(channel, udims, uv_index_list, metadata=[]):
+    """Returns the uv indexes and matching metadata in the UDIM selection, an empty uv index list selects from every patch"""
+    if len(uv_index_list) == 0:
+        uv_index_list = sorted([patch.uvIndex() for patch in channel.geoEntity().patchList()])
+    available = [uv_index + udim_mapping.UDIM_START for uv_index in uv_index_list]
+    selected = set(udim_mapping.parseSelection(udims, available))
+    keep = [index for index, udim in enumerate(available) if udim in selected]
+    return [uv_index_list[index] for index in keep], [metadata[index] for index in keep if index < len(metadata)]
+
+# ------------------------------------------------------------------------------
+def _isCurrentProject(project):
+    """Returns True if the current project has the given name or uuid"""
+    current = mari.projects.current()
+    return current is not None and project in (current.name(), current.uuid())
+
+# ------------------------------------------------------------------------------
+def _matchChannels(geo_patterns, channel_patterns):
+    """Returns the channels, excluding shader stacks, whose geo and channel names match any of the patterns"""
+    index = project_index.ProjectIndex()
+    channels = []
+    for geo in index.geos():
+        if not _matchesAny(geo.name(), geo_patterns):
+            continue
+        for channel in index.channels(geo.name()):
+            if not channel.isShaderStack() and _matchesAny(channel.name(), channel_patterns):
+                channels.append(channel)
+    return channels
+
+# ------------------------------------------------------------------------------
+def _matchesAny(name, patterns):
+    """Returns True if the name matches any of the names or glob patterns"""
+    return any([fnmatch.fnmatchcase(name, pattern) for pattern in patterns])
+
+# ------------------------------------------------------------------------------
+def _onlyModifiedTextures(channel, hash_index=None):
     """Manage channels so only modified patch images get exported"""
-    if channel.hasMetadata('OnlyModifiedTextures'):
+    if hash_index is not None:
+        uv_index_list, metadata = _getChangedUvIndexes(channel, hash_index.hashes(channel))
+    elif channel.hasMetadata('OnlyModifiedTextures'):
         uv_index_list, metadata = _getChangedUvIndexes(channel)   
     else:
         uv_index_list, metadata = _setChannelUvIndexes(channel)
     return uv_index_list, metadata
 
 # ------------------------------------------------------------------------------
-def _getChangedUvIndexes(channel):
-    """Get uv indexes with new hashes"""
+def _getChangedUvIndexes(channel, stored_hashes=None):
+    """Get uv indexes with new hashes, compared against the channel metadata or the stored hashes if given"""
     geo = channel.geoEntity()
     all_layers = _getAllLayers(channel.layerList())
-    patch_list = geo.patchList()
+    hashes = _createHashes(geo.patchList(), all_layers)
     uv_index_list = []
     metadata = []
-    for patch in patch_list:
-        hash_ = _createHash(patch, all_layers)
-        if not hash_ == channel.metadata(str(patch.uvIndex())):
-            uv_index_list.append(patch.uvIndex())
-            metadata.append((str(patch.uvIndex()), hash_))
+    for uv_index in sorted(hashes):
+        hash_ = hashes[uv_index]
+        if stored_hashes is None:
+            stored_hash = channel.metadata(str(uv_index))
+        else:
+            stored_hash = stored_hashes.get(uv_index)
+        if not hash_ == stored_hash:
+            uv_index_list.append(uv_index)
+            metadata.append((str(uv_index), hash_))
     return uv_index_list, metadata
 
 # ------------------------------------------------------------------------------
@@ -587,51 +1558,197 @@ def _setChannelUvIndexes(channel):
     """Set the channel metadata uv index hash"""
     geo = channel.geoEntity()
     all_layers = _getAllLayers(channel.layerList())
-    patch_list = geo.patchList()
+    hashes = _createHashes(geo.patchList(), all_layers)
     uv_index_list = []
     metadata = []
-    for patch in patch_list:
-        hash_ = _createHash(patch, all_layers)
-        uv_index_list.append(patch.uvIndex())
-        metadata.append((str(patch.uvIndex()), hash_))
+    for uv_index in sorted(hashes):
+        uv_index_list.append(uv_index)
+        metadata.append((str(uv_index), hashes[uv_index]))
     return uv_index_list, metadata
 
 # ------------------------------------------------------------------------------
-def _createHash(patch, all_layers):
-    """Create hashes on channel for all layers"""
-    hash_ = ''
-    index = patch.uvIndex()
+def _readHashIndex(args_dict):
+    """Returns the hash index read from disk, or None if it isn't used"""
+    if not (args_dict['only_modified_textures'] and args_dict['hash_index']):
+        return None
+    if sqlite3 is None:
+        raise ExportError('The hash index needs the sqlite3 module.')
+    hash_index = HashIndex(args_dict['path'])
+    try:
+        hash_index.read()
+    except sqlite3.Error, e:
+        raise ExportError('Failed to read hash index "%s"' %e)
+    return hash_index
+
+# ------------------------------------------------------------------------------
+def _storeHashes(channel, metadata, hash_index=None):
+    """Store the exported uv index hashes in the hash index, or on the channel metadata if there is no index"""
+    if hash_index is not None:
+        hash_index.update(channel, metadata)
+        return
+    for data in metadata:            
+        channel.setMetadata(*data)
+        channel.setMetadataEnabled(data[0], False)
+    channel.setMetadata('OnlyModifiedTextures', True)
+    channel.setMetadataEnabled('OnlyModifiedTextures', False)
+
+# ------------------------------------------------------------------------------
+def _commitHashIndex(hash_index):
+    """Write the hash index to disk in one transaction"""
+    if hash_index is None:
+        return
+    try:
+        hash_index.commit()
+    except sqlite3.Error, e:
+        raise ExportError('Failed to write hash index "%s"' %e)
 
+# ------------------------------------------------------------------------------
+class HashIndex(object):
+    """Sidecar file next to the export path storing exported uv index hashes,
+    keyed by project uuid, geo, channel, udim and export template."""
+    def __init__(self, path_template):
+        directory, self.template = os.path.split(path_template)
+        self.path = os.path.join(directory, HASH_INDEX_FILENAME)
+        self.project = mari.projects.current().uuid()
+        self._hashes = {}
+        self._changed = {}
+
+    def read(self):
+        "Read every hash for this project and export template in one query."
+        self._hashes = {}
+        self._changed = {}
+        if not os.path.exists(self.path):
+            return
+        connection = sqlite3.connect(self.path)
+        try:
+            _createHashIndexTable(connection)
+            rows = connection.execute(
+                'SELECT geo, channel, udim, hash FROM hashes WHERE project=? AND template=?',
+                (self.project, self.template)
+                )
+            for geo, channel, udim, hash_ in rows:
+                self._hashes.setdefault((geo, channel), {})[udim - 1001] = hash_
+        finally:
+            connection.close()
+
+    def hashes(self, channel):
+        "Returns a dict of uv index : hash for the channel."
+        return self._hashes.get(_channelKey(channel), {})
+
+    def update(self, channel, metadata):
+        "Store the (uv index, hash) pairs of an exported channel, written on commit."
+        key = _channelKey(channel)
+        for uv_index, hash_ in metadata:
+            self._hashes.setdefault(key, {})[int(uv_index)] = hash_
+            self._changed[key + (int(uv_index) + 1001,)] = hash_
+
+    def commit(self):
+        "Write all updated hashes in a single transaction."
+        if not self._changed:
+            return
+        connection = sqlite3.connect(self.path)
+        try:
+            _createHashIndexTable(connection)
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO hashes (project, geo, channel, udim, template, hash) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(self.project, geo, channel, udim, self.template, hash_) for (geo, channel, udim), hash_ in self._changed.items()]
+                    )
+        finally:
+            connection.close()
+        self._changed = {}
+
+# ------------------------------------------------------------------------------
+def _createHashIndexTable(connection):
+    """Create the hash index table if it doesn't exist yet"""
+    with connection:
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS hashes (project TEXT, geo TEXT, channel TEXT, udim INTEGER, template TEXT, hash TEXT, '
+            'PRIMARY KEY (project, geo, channel, udim, template))'
+            )
+
+# ------------------------------------------------------------------------------
+def _channelKey(channel):
+    """Returns a (geo name, channel name) key for the channel"""
+    return (channel.geoEntity().name(), channel.name())
+
+# ------------------------------------------------------------------------------
+def _createHashes(patch_list, all_layers):
+    """Create hashes on channel for all layers, returns a dict of uv index : hash.
+    Layer data is collected once per layer and streamed into the hash, only the patch images are read per patch.
+    The digests are the same as hashing the whole layer data string for each patch, so existing metadata still matches."""
+    prefix, leaves = _buildHashTree(all_layers)
+    hashes = {}
+    for patch in patch_list:
+        index = patch.uvIndex()
+        sha256 = prefix.copy()
+        for image_set, data in leaves:
+            sha256.update(image_set.image(index).hash())
+            sha256.update(data)
+        hashes[index] = sha256.hexdigest()
+    return hashes
+
+# ------------------------------------------------------------------------------
+def _buildHashTree(all_layers):
+    """Returns a hash of the layer data before the first patch image and a list of (image set, layer data after it)."""
+    prefix = hashlib.sha256()
+    leaves = []
+    data = []
+    image_set = None
     for layer in all_layers:
-        hash_ += _basicLayerData(layer)
-
-        if layer.isAdjustmentLayer():
-            for adjustmentParameter in layer.primaryAdjustmentParameters():
-                hash_ += str(layer.getPrimaryAdjustmentParameter(adjustmentParameter))
-            # If this layer has a secondary adjustment then capture that data as well.
-            if layer.hasSecondaryAdjustment():
-                for adjustmentParameter in layer.secondaryAdjustmentParameters():
-                    hash_ += str(layer.getPrimaryAdjustmentParameter(adjustmentParameter))
-
-        elif layer.isProceduralLayer():
-                for proceduralParameter in layer.proceduralParameters():
-                    if 'Cache' in proceduralParameter:
-                        continue
-                    parameterValue = layer.getProceduralParameter(proceduralParameter)
-                    if isinstance(parameterValue, mari.Color):
-                        hash_ += str(parameterValue.rgba())
-                    elif isinstance(parameterValue, mari.LookUpTable):
-                        hash_ += parameterValue.controlPointsAsString()
-                    else:
-                        hash_ += str(parameterValue)
-
-        elif layer.isPaintableLayer():
-            hash_ += layer.imageSet().image(index).hash()
-            
-        elif layer.hasMask():
-            hash_ += layer.maskImageSet().image(index).hash()
+        data.append(_layerData(layer))
+        leaf = _layerImageSet(layer)
+        if leaf is None:
+            continue
+        if image_set is None:
+            prefix.update(''.join(data))
+        else:
+            leaves.append((image_set, ''.join(data)))
+        image_set = leaf
+        data = []
+    if image_set is None:
+        prefix.update(''.join(data))
+    else:
+        leaves.append((image_set, ''.join(data)))
+    return prefix, leaves
+
+# ------------------------------------------------------------------------------
+def _layerData(layer):
+    """Collect the layer data that is the same for every patch."""
+    data = _basicLayerData(layer)
+
+    if layer.isAdjustmentLayer():
+        for adjustmentParameter in layer.primaryAdjustmentParameters():
+            data += str(layer.getPrimaryAdjustmentParameter(adjustmentParameter))
+        # If this layer has a secondary adjustment then capture that data as well.
+        if layer.hasSecondaryAdjustment():
+            for adjustmentParameter in layer.secondaryAdjustmentParameters():
+                data += str(layer.getPrimaryAdjustmentParameter(adjustmentParameter))
+
+    elif layer.isProceduralLayer():
+        for proceduralParameter in layer.proceduralParameters():
+            if 'Cache' in proceduralParameter:
+                continue
+            parameterValue = layer.getProceduralParameter(proceduralParameter)
+            if isinstance(parameterValue, mari.Color):
+                data += str(parameterValue.rgba())
+            elif isinstance(parameterValue, mari.LookUpTable):
+                data += parameterValue.controlPointsAsString()
+            else:
+                data += str(parameterValue)
 
-    return _sha256(hash_)
+    return data
+
+# ------------------------------------------------------------------------------
+def _layerImageSet(layer):
+    """Returns the image set hashed per patch for the layer, or None if the layer has no patch images."""
+    if layer.isAdjustmentLayer() or layer.isProceduralLayer():
+        return None
+    elif layer.isPaintableLayer():
+        return layer.imageSet()
+    elif layer.hasMask():
+        return layer.maskImageSet()
+    return None
 
 # ------------------------------------------------------------------------------
 def _getAllLayers(layer_list):
@@ -667,13 +1784,6 @@ def _basicLayerData(layer):
     str(layer.blendModeStr()) + \
     str(layer.isVisible())
 
-# ------------------------------------------------------------------------------
-def _sha256(string):
-    """Returns a hash for the given string."""
-    sha256 = hashlib.sha256()
-    sha256.update(string)
-    return sha256.hexdigest()
-
 # ------------------------------------------------------------------------------
 def _isProjectSuitable():
     """Checks project state."""
@@ -0,0 +1,43 @@
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Human readable sizes and durations for progress and summary messages
+# coding: utf-8
+# Written by Jorel Latraille
+# ------------------------------------------------------------------------------
+# DISCLAIMER & TERMS OF USE:
+#
+# Copyright (c) The Foundry 2014.
+# All rights reserved.
+#
+# This software is provided as-is with use in commercial projects permitted.
+# Redistribution in commercial projects is also permitted
+# provided that the above copyright notice and this paragraph are
+# duplicated in accompanying documentation,
+# and acknowledge that the software was developed
+# by The Foundry.  The name of the
+# The Foundry may not be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND WITHOUT ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+
+version = "0.01"
+
+# ------------------------------------------------------------------------------
+def formatBytes(bytes_):
+    "Returns a human readable size."
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_ < 1024.0:
+            return '%.1f %s' %(bytes_, unit)
+        bytes_ /= 1024.0
+    return '%.1f TB' %bytes_
+
+# ------------------------------------------------------------------------------
+def formatSeconds(seconds):
+    "Returns a human readable duration."
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%dh %02dm %02ds' %(hours, minutes, seconds)
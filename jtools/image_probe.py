@@ -0,0 +1,186 @@
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Read image sizes and bit depths from file headers without decoding pixels
+# coding: utf-8
+# Written by Jorel Latraille
+# ------------------------------------------------------------------------------
+# DISCLAIMER & TERMS OF USE:
+#
+# Copyright (c) The Foundry 2014.
+# All rights reserved.
+#
+# This software is provided as-is with use in commercial projects permitted.
+# Redistribution in commercial projects is also permitted
+# provided that the above copyright notice and this paragraph are
+# duplicated in accompanying documentation,
+# and acknowledge that the software was developed
+# by The Foundry.  The name of the
+# The Foundry may not be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND WITHOUT ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+import os, struct, threading, Queue
+
+version = "0.01"
+
+PROBE_THREAD_COUNT = 8
+HEADER_READ_SIZE = 64 * 1024    # bytes read for formats whose header isn't at a known offset
+
+# ------------------------------------------------------------------------------
+def probeImage(path):
+    "Returns {'width', 'height', 'depth'} from the image header, depth is bits per channel. Returns None for unknown or broken files."
+    try:
+        with open(path, 'rb') as file_:
+            header = file_.read(16)
+            file_.seek(0)
+            if header.startswith('\x89PNG\r\n\x1a\n'):
+                return _probePng(file_)
+            if header[:4] in ('II*\x00', 'MM\x00*'):
+                return _probeTiff(file_)
+            if header.startswith('\x76\x2f\x31\x01'):
+                return _probeExr(file_)
+            if header.startswith('\xff\xd8'):
+                return _probeJpeg(file_)
+            if os.path.splitext(path)[1].lower() == '.tga':
+                return _probeTga(file_)
+    except (IOError, OSError, struct.error, ValueError):
+        pass
+    return None
+
+# ------------------------------------------------------------------------------
+def probeImages(paths, thread_count=PROBE_THREAD_COUNT):
+    "Probes the images on worker threads, returns a dict of path : probeImage result."
+    results = {}
+    queue = Queue.Queue()
+    lock = threading.Lock()
+    def work():
+        while True:
+            path = queue.get()
+            if path is None:
+                return
+            result = probeImage(path)
+            with lock:
+                results[path] = result
+    threads = []
+    for index in range(min(thread_count, max(len(paths), 1))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for path in paths:
+        queue.put(path)
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    return results
+
+# ------------------------------------------------------------------------------
+def textureSize(width, height, sizes):
+    "Returns the smallest texture size that holds the image, or the largest size if none do."
+    sizes = sorted(sizes)
+    for size in sizes:
+        if size >= max(width, height):
+            return size
+    return sizes[-1]
+
+# ------------------------------------------------------------------------------
+def _result(width, height, depth):
+    if width <= 0 or height <= 0:
+        return None
+    return {'width' : width, 'height' : height, 'depth' : depth}
+
+# ------------------------------------------------------------------------------
+def _probePng(file_):
+    "IHDR is always the first chunk, its bit depth is per channel."
+    data = file_.read(26)
+    width, height, depth = struct.unpack('>IIB', data[16:25])
+    return _result(width, height, depth)
+
+# ------------------------------------------------------------------------------
+def _probeTiff(file_):
+    "Reads the width, height and bits per sample tags of the first IFD, the sample format isn't read."
+    endian = '<' if file_.read(2) == 'II' else '>'
+    file_.read(2)
+    offset = struct.unpack(endian + 'I', file_.read(4))[0]
+    file_.seek(offset)
+    count = struct.unpack(endian + 'H', file_.read(2))[0]
+    entries = file_.read(count * 12)
+    tags = {}
+    for index in range(count):
+        tag, type_, value_count, value = struct.unpack(endian + 'HHI4s', entries[index * 12:index * 12 + 12])
+        if tag not in (256, 257, 258):
+            continue
+        if type_ == 3:
+            if value_count > 2:
+                file_.seek(struct.unpack(endian + 'I', value)[0])
+                value = file_.read(2)
+            tags[tag] = struct.unpack(endian + 'H', value[:2])[0]
+        else:
+            tags[tag] = struct.unpack(endian + 'I', value)[0]
+    return _result(tags.get(256, 0), tags.get(257, 0), tags.get(258, 1))
+
+# ------------------------------------------------------------------------------
+def _probeExr(file_):
+    "Reads the header attributes up to the end of header, half channels are 16 bit and uint or float channels are 32 bit."
+    data = file_.read(HEADER_READ_SIZE)
+    position = 8
+    width = height = 0
+    depth = 16
+    while position < len(data):
+        end = data.index('\x00', position)
+        name = data[position:end]
+        if name == '':
+            break
+        type_end = data.index('\x00', end + 1)
+        size = struct.unpack('<i', data[type_end + 1:type_end + 5])[0]
+        value = data[type_end + 5:type_end + 5 + size]
+        if name == 'dataWindow':
+            x_min, y_min, x_max, y_max = struct.unpack('<iiii', value)
+            width, height = x_max - x_min + 1, y_max - y_min + 1
+        elif name == 'channels':
+            depth = _exrChannelDepth(value)
+        position = type_end + 5 + size
+    return _result(width, height, depth)
+
+# ------------------------------------------------------------------------------
+def _exrChannelDepth(value):
+    "Returns the largest bit depth in an EXR chlist attribute."
+    depth = 16
+    position = 0
+    while position < len(value) and value[position] != '\x00':
+        end = value.index('\x00', position)
+        pixel_type = struct.unpack('<i', value[end + 1:end + 5])[0]
+        if pixel_type != 1:
+            depth = 32
+        position = end + 17
+    return depth
+
+# ------------------------------------------------------------------------------
+def _probeJpeg(file_):
+    "Walks the markers to the first start of frame."
+    file_.read(2)
+    while True:
+        marker = file_.read(2)
+        if len(marker) < 2 or marker[0] != '\xff':
+            return None
+        code = ord(marker[1])
+        if code == 0xff:
+            file_.seek(-1, 1)
+            continue
+        length = struct.unpack('>H', file_.read(2))[0]
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            depth, height, width = struct.unpack('>BHH', file_.read(5))
+            return _result(width, height, depth)
+        file_.seek(length - 2, 1)
+
+# ------------------------------------------------------------------------------
+def _probeTga(file_):
+    "The 18 byte header holds the size, every TGA pixel format is 8 bits per channel or less."
+    header = file_.read(18)
+    width, height = struct.unpack('<HH', header[12:16])
+    return _result(width, height, 8)
@@ -23,7 +23,8 @@
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
 
-import mari, os
+import mari, os, re, json, hashlib, csv, time
+import directory_scanner, image_probe, project_index
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
 
@@ -31,10 +32,25 @@ version = "0.04"
 
 image_file_types = ['.' + format for format in mari.images.supportedReadFormats()]
 tokens = ['$ENTITY', '$CHANNEL', '$LAYER', '$UDIM']
+token_groups = {'$ENTITY' : 'entity', '$CHANNEL' : 'channel', '$LAYER' : 'layer', '$UDIM' : 'udim'}
 channel_resolution_options = [str(QSize.width()) for QSize in mari.images.supportedTextureSizes()]
 channel_bit_depth_options = ['8', '16', '32']
 layer_import_options = ['Update', 'Create New', 'Skip']
 resize_options = ['Patch', 'Image']
+update_layer_option = layer_import_options.index('Update') + 1
+import_record_key = 'JToolsImportedImages'
+manifest_defaults = {
+'entity' : None,
+'channel' : None,
+'layer' : None,
+'path' : None,
+'resolution' : 2048,
+'depth' : 8,
+'layer_option' : 'Update',
+'resize' : 'Patch',
+'only_changed' : True,
+'compare_contents' : False
+}
 
 # ------------------------------------------------------------------------------
 class importImagesUI(QtGui.QDialog):
@@ -48,11 +64,15 @@ class importImagesUI(QtGui.QDialog):
         bit_depth = int(settings.value('jtoolsImportImagesUI/bitDepth')) if settings.value('jtoolsImportImagesUI/bitDepth') != None else 1
         layer_option = int(settings.value('jtoolsImportImagesUI/layerOption')) if settings.value('jtoolsImportImagesUI/layerOption') != None else 0
         resize = int(settings.value('jtoolsImportImagesUI/resize')) if settings.value('jtoolsImportImagesUI/resize') != None else 0
+        size_from_images = int(settings.value('jtoolsImportImagesUI/sizeFromImages')) if settings.value('jtoolsImportImagesUI/sizeFromImages') != None else 1
+        only_changed = int(settings.value('jtoolsImportImagesUI/onlyChanged')) if settings.value('jtoolsImportImagesUI/onlyChanged') != None else 1
+        compare_contents = int(settings.value('jtoolsImportImagesUI/compareContents')) if settings.value('jtoolsImportImagesUI/compareContents') != None else 0
 
         main_layout = QtGui.QVBoxLayout()
         path_layout = QtGui.QGridLayout()
         import_layout = QtGui.QHBoxLayout()
         options_layout = QtGui.QHBoxLayout()
+        update_layout = QtGui.QHBoxLayout()
         button_layout = QtGui.QGridLayout()
         
         #Add path line input and button
@@ -91,6 +111,15 @@ class importImagesUI(QtGui.QDialog):
         for option in resize_options:
             self.resize_options.addItem(option)
         self.resize_options.setCurrentIndex(resize)
+        self.size_from_images_box = QtGui.QCheckBox('Size New Channels From Images')
+        self.size_from_images_box.setToolTip('Read the image headers to set the resolution and bit depth of new channels and their patches')
+        self.size_from_images_box.setChecked(bool(size_from_images))
+        self.only_changed_box = QtGui.QCheckBox('Only Import Changed UDIMs')
+        self.only_changed_box.setToolTip('When updating a layer imported before, only load the UDIMs whose files changed since the last import')
+        self.only_changed_box.setChecked(bool(only_changed))
+        self.compare_contents_box = QtGui.QCheckBox('Compare File Contents')
+        self.compare_contents_box.setToolTip('Hash the files so UDIMs that were saved again without changes are not imported')
+        self.compare_contents_box.setChecked(bool(compare_contents))
         
         #Add OK/Cancel buttons
         ok_button = QtGui.QPushButton("&OK")
@@ -110,6 +139,10 @@ class importImagesUI(QtGui.QDialog):
         options_layout.addWidget(self.layer_import_options)
         options_layout.addWidget(resize_label)
         options_layout.addWidget(self.resize_options)
+        options_layout.addWidget(self.size_from_images_box)
+        update_layout.addWidget(self.only_changed_box)
+        update_layout.addWidget(self.compare_contents_box)
+        update_layout.addStretch()
         button_layout.addWidget(ok_button, 1, 0)
         button_layout.addWidget(cancel_button, 1, 1)
         
@@ -117,6 +150,7 @@ class importImagesUI(QtGui.QDialog):
         main_layout.addLayout(path_layout)
         main_layout.addLayout(import_layout)
         main_layout.addLayout(options_layout)
+        main_layout.addLayout(update_layout)
         main_layout.addLayout(button_layout)
         self.setLayout(main_layout)
         self.setWindowTitle("Import Images")
@@ -149,137 +183,36 @@ class importImagesUI(QtGui.QDialog):
         if import_template == '':
             mari.utils.message('Please provide import template.')
             return
-        type_found = False
-        for type in image_file_types:
-            if import_template.endswith(type):
-                type_found = True
-                self.type = type
-                break
-        if not type_found:
+        try:
+            self.template = ImportTemplate(import_template)
+        except ValueError:
             self.import_template.selectAll()
             return
         
-        #Create template list and remove any tokens
-        import_template = import_template[:-len(self.type)]
-        if '.' in import_template:
-            self.template = import_template.split('.')
-            spliter = '.'
-        elif '_' in import_template:
-            self.template = import_template.split('_')
-            spliter = '_'
-        else:
-            self.template = import_template
-            spliter = ''
-        self.template_no_token = list(self.template)
-        for item in self.template:
-            if item in tokens:
-                i = self.template_no_token.index(item)
-                self.template_no_token.pop(i)
-        
-        #Get list of files in directory and check that type given matches files
+        #Scan the directory tree on worker threads, matching each file against the template once
         searching = SearchingGUI()
         searching.show()
-        self.file_dict = {}
-        self.file_path_dict = {}
-        try:
-            for root, subdirs, files in os.walk(file_path):
-                for file_ in files:
-                    if not searching.getRejected():
-                        searching.updateProgressBar()
-                        if file_.lower().endswith(type):
-                            found = False
-                            if len(self.template_no_token) > 0:
-                                for item in self.template_no_token:
-                                    if item in file_:
-                                        found = True
-                                    else:
-                                        pass
-                            else:
-                                found = True
-                            if found:
-                                self.file_dict[file_] = os.path.abspath(os.path.join(root, file_))
-                                self.file_path_dict[file_] = os.path.abspath(root)
-                    else:
-                        searching.reject()
-                        mari.utils.message('Searching for files cancelled.')
-                        return
-        except:
-            raise
-        searching.reject()
-        if len(self.file_dict) == 0:
-            mari.utils.message('No files match import template %s' %self.import_template.text())
+        scanner = directory_scanner.DirectoryScanner(file_path, self.template.match)
+        if not scanner.run(searching.updateProgress):
+            searching.reject()
+            mari.utils.message('Searching for files cancelled.')
             return
-        
-        #Check import_template and image name match
-        #Get a list of split image names to compare
-        image_names = {}
-        for file_ in self.file_dict:
-            image_names[file_] = file_[:-len(self.type)]
-        self.split_names = {}
-        for file_ in image_names:
-            if not spliter == '':
-                self.split_names[file_] = image_names[file_].split(spliter)
-            elif file_ == self.import_template.text():
-                self.split_names[file_] = image_names[file_]
-        if len(self.split_names) == 0:
+        searching.reject()
+        self.import_groups = {}
+        for root, file_, match in scanner.results:
+            addImportFile(self.import_groups, match, root, file_)
+        if len(self.import_groups) == 0:
             mari.utils.message('No files match import template %s' %self.import_template.text())
             return
-        self.match_image_template = {}
-        self.image_template = []
-        self.file_names_short = []
-        self.file_names_long = []
-        self.except_template = []
-        for file_ in self.split_names:
-            if len(self.template) == len(self.split_names[file_]):
-                if '$UDIM' in self.template:
-                    it = self.template.index('$UDIM')
-                    copy_split_names = list(self.split_names[file_])
-                    copy_split_names.pop(it)
-                    join_names = ".".join(copy_split_names)
-                    if join_names in self.file_names_short:
-                        pass
-                    else:
-                        self.file_names_short.append(join_names)
-                        self.file_names_long.append(file_)
-                        self.match_image_template[file_] = self.split_names[file_]
-                    if tuple(copy_split_names) in self.image_template:
-                        pass
-                    else:
-                        self.image_template.append(tuple(copy_split_names))
-                else:
-                    self.file_names_short.append(file_)
-                    self.file_names_long.append(file_)
-                    self.match_image_template[file_] = self.split_names[file_]
-        if len(self.match_image_template) == 0:
-            mari.utils.misc.message('Import template and image name(s) do not match')
-            return
         
-        #Create geo dictionary with geo name as key, and geo dictionary index 0 as geo and subsequent indexes as channels        
-        geo_list = mari.geo.list()
-        self.geo_dict = {}
-        for geo in geo_list:
-            geo_info = []
-            geo_info.append(geo)
-            geo_info.extend(geo.channelList())
-            self.geo_dict[geo.name()] = geo_info
-        #Iterate through match_image_template and file_dict, compare and run appropriate command
-        for mkey in self.match_image_template:
-            for fkey in self.file_dict:
-                if fkey == mkey:
-                    for index in range(len(self.template)):
-                        if self.template[index] == '$ENTITY':
-                            entity = self.match_image_template[mkey][index]
-                            if entity in self.geo_dict:
-                                pass
-                            else:
-                                mari.utils.misc.message("Import template $ENTITY image file name '%s' does not match geo name(s) in project" %entity)
-                                return
-        
-        #Get a list of file_ paths that co-inside with file_ names
-        self.file_paths = []
-        for name in self.file_names_long:
-            if name in self.file_path_dict:
-                self.file_paths.append(self.file_path_dict[name])
+        #Check every $ENTITY matches a geo name in the project
+        self.project_index = project_index.ProjectIndex()
+        if self.template.hasToken('$ENTITY'):
+            geo_names = self.project_index.geoNames()
+            for entity, channel, layer in self.import_groups:
+                if entity not in geo_names:
+                    mari.utils.misc.message("Import template $ENTITY image file name '%s' does not match geo name(s) in project" %entity)
+                    return
 
         self.accept()
         
@@ -298,20 +231,23 @@ class importImagesUI(QtGui.QDialog):
     def returnResizeOption(self):
         return self.resize_options.currentIndex()
         
-    def returnTemplate(self):
-        return self.template
+    def returnSizeFromImages(self):
+        return self.size_from_images_box.isChecked()
         
-    def returnGeoDict(self):
-        return self.geo_dict
+    def returnOnlyChanged(self):
+        return self.only_changed_box.isChecked()
         
-    def returnFileNamesShort(self):
-        return self.file_names_short
+    def returnCompareContents(self):
+        return self.compare_contents_box.isChecked()
+        
+    def returnTemplate(self):
+        return self.template
         
-    def returnFilePaths(self):
-        return self.file_paths
+    def returnImportGroups(self):
+        return self.import_groups
         
-    def returnImageTemplate(self):
-        return self.image_template
+    def returnProjectIndex(self):
+        return self.project_index
 
 # ------------------------------------------------------------------------------       
 class SearchingGUI(QtGui.QDialog):
@@ -324,7 +260,7 @@ class SearchingGUI(QtGui.QDialog):
         main_layout = QtGui.QVBoxLayout()
         
         #Add label, progress bar and cancel button
-        search_label = QtGui.QLabel('Searching for images...')
+        self.search_label = QtGui.QLabel('Searching for images...')
         self.progressBar = QtGui.QProgressBar()
         self.progressBar.setMaximum(0)
         self.progressBar.setTextVisible(False)
@@ -333,7 +269,7 @@ class SearchingGUI(QtGui.QDialog):
         cancel_button.clicked.connect(self.setRejected)
         self.rejected_status = False
         
-        main_layout.addWidget(search_label)
+        main_layout.addWidget(self.search_label)
         main_layout.addWidget(self.progressBar)
         main_layout.addWidget(cancel_button)
         
@@ -345,16 +281,11 @@ class SearchingGUI(QtGui.QDialog):
     def getRejected(self):
         return self.rejected_status
         
-    def setProgressBar(self, value):
-        self.progressBar.setValue(value)
+    def updateProgress(self, directories, files):
+        "Shows the search counts and processes events, returns False if the search was cancelled."
+        self.search_label.setText('Searching for images... %d folders, %d matching images' %(directories, files))
         QtGui.QApplication.processEvents()
-        
-    def updateProgressBar(self):
-        current_value = self.progressBar.value()
-        if current_value < 100:
-            self.setProgressBar(current_value() + 1)
-        else:
-            self.setProgressBar(0)        
+        return not self.rejected_status
         
 # ------------------------------------------------------------------------------        
 def importImages():
@@ -367,16 +298,16 @@ def importImages():
     if not dialog.exec_():
         return
 
-    import_template = dialog.returnImportTemplate()
     channel_res = dialog.returnChannelResOption()
     channel_bit = dialog.returnChannelBitOption()
     layer_option = dialog.returnLayerImportOption()
     resize_option = dialog.returnResizeOption()
+    size_from_images = dialog.returnSizeFromImages()
+    only_changed = dialog.returnOnlyChanged()
+    compare_contents = dialog.returnCompareContents()
     template = dialog.returnTemplate()
-    geo_dict = dialog.returnGeoDict()
-    file_names_short = dialog.returnFileNamesShort()
-    file_paths = dialog.returnFilePaths()
-    image_template = dialog.returnImageTemplate()
+    import_groups = dialog.returnImportGroups()
+    index = dialog.returnProjectIndex()
 
     # Save user config for ImportUI settings
     settings = mari.Settings()
@@ -385,108 +316,479 @@ def importImages():
     settings.setValue('bitDepth', channel_bit)
     settings.setValue('layerOption', layer_option)
     settings.setValue('resize', resize_option)
+    settings.setValue('sizeFromImages', int(size_from_images))
+    settings.setValue('onlyChanged', int(only_changed))
+    settings.setValue('compareContents', int(compare_contents))
     settings.endGroup()
     
     channel_res = channel_resolution_options[channel_res]
     channel_bit = channel_bit_depth_options[channel_bit]
 
-    #Import images onto corresponding token info
-    for file_ in file_names_short:
-        ifile_ = file_names_short.index(file_)
-        if '$ENTITY' in template:
-            ient = template.index('$ENTITY')
-            entity = image_template[ifile_][ient]
-            geo_dict[entity][0].setSelected(True)
-            if '$CHANNEL' in template:
-                ichan = template.index('$CHANNEL')
-                channel = image_template[ifile_][ichan]
-                item_list = []
-                for item in geo_dict[entity]:
-                    item_list.append(item.name())
-                if channel in item_list:
-                    ilist = item_list.index(channel)
-                    channel = geo_dict[entity][ilist]
+    #Geos and channels are looked up by name in the project index, which follows channels created by the import
+    with index:
+        #Size the channels that will be created from their image headers
+        channel_sizes = {}
+        if size_from_images:
+            channel_sizes = planChannelSizes(template, import_groups, index)
+
+        #Import images onto corresponding token info
+        for key in sorted(import_groups):
+            group = import_groups[key]
+            if template.hasToken('$ENTITY'):
+                geo = index.geo(group.entity)
+                geo.setSelected(True)
+            else:
+                geo = mari.geo.current()
+            
+            if template.hasToken('$CHANNEL'):
+                channel = index.channel(geo.name(), group.channel)
+                if channel is not None:
                     channel.makeCurrent()
-                    old_layer_list = channel.layerList()
-                    channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-                    layer_list = channel.layerList()
-                    if len(old_layer_list) != len(layer_list):
-                        if '$LAYER' in template:
-                            ilay = template.index('$LAYER')
-                            layer_list[0].setName(image_template[ifile_][ilay])
-                        else:
-                            layer_list[0].setName(file_names_short[ifile_])
                 else:
-                    channel = geo_dict[entity][0].createChannel(channel, channel_res, channel_res, channel_bit)
-                    old_layer_list = channel.layerList()
-                    channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-                    layer_list = channel.layerList()
-                    if len(old_layer_list) != len(layer_list):
-                        if '$LAYER' in template:
-                            ilay = template.index('$LAYER')
-                            layer_list[0].setName(image_template[ifile_][ilay])
-                        else:
-                            layer_list[0].setName(file_names_short[ifile_])
+                    channel = createImportChannel(geo, group.channel, channel_sizes, channel_res, channel_bit)
+                    index.addChannel(geo, channel)
+            elif template.hasToken('$ENTITY'):
+                channel = createImportChannel(geo, group.name, channel_sizes, channel_res, channel_bit)
+                index.addChannel(geo, channel)
             else:
-                channel = geo_dict[entity][0].createChannel(file_, channel_res, channel_res, channel_bit)
-                old_layer_list = channel.layerList()
-                channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-                layer_list = channel.layerList()
-                if len(old_layer_list) != len(layer_list):
-                    if '$LAYER' in template:
-                        ilay = template.index('$LAYER')
-                        layer_list[0].setName(image_template[ifile_][ilay])
-                    else:
-                        layer_list[0].setName(file_names_short[ifile_])
+                channel = geo.currentChannel()
+                
+            importGroup(channel, group, template, resize_option, layer_option, only_changed, compare_contents)
                     
-        elif '$CHANNEL' in template:
-            ichan = template.index('$CHANNEL')
-            channel = image_template[ifile_][ichan]
-            item_list = []
-            for item in mari.geo.current().channelList():
-                item_list.append(item.name())
-            if channel in item_list:
-                ilist = item_list.index(channel)
-                channel = mari.geo.current().channelList()[ilist]
-                channel.makeCurrent()
-                old_layer_list = channel.layerList()
-                channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-                layer_list = channel.layerList()
-                if len(old_layer_list) != len(layer_list):
-                    if '$LAYER' in template:
-                        ilay = template.index('$LAYER')
-                        layer_list[0].setName(image_template[ifile_][ilay])
-                    else:
-                        layer_list[0].setName(file_names_short[ifile_])
+# ------------------------------------------------------------------------------
+def importGroup(channel, group, template, resize_option, layer_option, only_changed=False, compare_contents=False, layer_name=None):
+    """Import a group's images into the channel and name the new layer. When updating a layer that has an import record
+    only the UDIMs whose files changed are loaded into it, if a changed file isn't the size of its patch the whole group
+    is imported with the resize option instead. Returns the number of UDIMs or files imported."""
+    if layer_name is None:
+        layer_name = group.layer if template.hasToken('$LAYER') else group.name
+    incremental = len(group.udims) > 0 and len(group.udims) == len(group.files)
+    if only_changed and incremental and layer_option == update_layer_option:
+        layer = findLayer(channel, layer_name)
+        old_record = readImportRecord(layer)
+        if old_record is not None:
+            record = currentImportRecord(group, compare_contents, old_record)
+            changed = changedUdims(old_record, record, compare_contents)
+            loaded = loadChangedUdims(channel, layer, record, old_record, changed)
+            if loaded is not None:
+                writeImportRecord(layer, record)
+                return loaded
+
+    old_layer_list = channel.layerList()
+    channel.importImages(template.importPath(group), resize_option, layer_option)
+    layer_list = channel.layerList()
+    if len(old_layer_list) != len(layer_list):
+        layer_list[0].setName(layer_name)
+    if incremental:
+        layer = findLayer(channel, layer_name)
+        if layer is not None:
+            writeImportRecord(layer, currentImportRecord(group, compare_contents, readImportRecord(layer) or {}))
+    return len(group.files)
+
+# ------------------------------------------------------------------------------
+def importFromManifest(manifest):
+    """Import every row of a manifest without any dialogs, for the Python console or terminal mode Mari.
+    manifest is a list of row dicts, a JSON string, or the path of a JSON or CSV file, see manifest_defaults for the columns.
+    path is a file pattern with $UDIM, e.g. /textures/body.diff.$UDIM.tif. Rows are grouped by channel so each channel is
+    made current once and all of its layers are imported back to back, under one undo macro. Returns a result dict."""
+    start = time.time()
+    result = {'success' : False, 'error' : None, 'seconds' : 0.0, 'imports' : []}
+    try:
+        rows = readManifest(manifest)
+        if mari.projects.current() is None:
+            raise ValueError('No project is open.')
+    except (ValueError, IOError, OSError), e:
+        result['error'] = str(e)
+        mari.app.log('Import from manifest failed "%s"' %e)
+        result['seconds'] = time.time() - start
+        return result
+
+    #Group rows by channel, keeping the manifest order
+    channel_rows = {}
+    channel_order = []
+    for row in rows:
+        key = (row['entity'], row['channel'])
+        if key not in channel_rows:
+            channel_rows[key] = []
+            channel_order.append(key)
+        channel_rows[key].append(row)
+
+    mari.history.startMacro('Import Images From Manifest')
+    try:
+        with project_index.ProjectIndex() as index:
+            for key in channel_order:
+                result['imports'].extend(_importManifestChannel(key, channel_rows[key], index))
+    finally:
+        mari.history.stopMacro()
+    result['seconds'] = time.time() - start
+    result['success'] = all([entry['error'] is None for entry in result['imports']])
+    mari.app.log(_manifestReport(result))
+    return result
+
+# ------------------------------------------------------------------------------
+def readManifest(manifest):
+    "Returns the manifest rows filled in with the defaults, raises ValueError for unknown columns or rows without a channel or path."
+    if isinstance(manifest, basestring):
+        if os.path.isfile(manifest) and manifest.lower().endswith('.csv'):
+            with open(manifest, 'rb') as file_:
+                manifest = [dict([(key, value) for key, value in row.items() if value not in (None, '')]) for row in csv.DictReader(file_)]
+        elif os.path.isfile(manifest):
+            with open(manifest, 'r') as file_:
+                manifest = json.load(file_)
+        else:
+            manifest = json.loads(manifest)
+    if isinstance(manifest, dict):
+        manifest = manifest.get('imports', [])
+    rows = []
+    for index, row in enumerate(manifest):
+        unknown = [key for key in row if key not in manifest_defaults]
+        if unknown:
+            raise ValueError('Unknown manifest columns in row %d: %s' %(index + 1, ', '.join(sorted(unknown))))
+        if not row.get('channel') or not row.get('path'):
+            raise ValueError('Manifest row %d needs a channel and a path.' %(index + 1))
+        filled = dict(manifest_defaults)
+        filled.update(row)
+        if filled['layer_option'] not in layer_import_options:
+            raise ValueError('Manifest row %d layer_option must be one of %s.' %(index + 1, ', '.join(layer_import_options)))
+        if filled['resize'] not in resize_options:
+            raise ValueError('Manifest row %d resize must be one of %s.' %(index + 1, ', '.join(resize_options)))
+        for key in ('only_changed', 'compare_contents'):
+            if isinstance(filled[key], basestring):
+                filled[key] = filled[key].lower() in ('1', 'true', 'yes')
+        filled['resolution'] = int(filled['resolution'])
+        filled['depth'] = int(filled['depth'])
+        rows.append(filled)
+    if len(rows) == 0:
+        raise ValueError('The manifest has no rows.')
+    return rows
+
+# ------------------------------------------------------------------------------
+def _importManifestChannel(key, rows, index):
+    "Make the channel current once, creating it from the first row if needed, then import each row's layer. Returns a timing entry per row."
+    entity, channel_name = key
+    entries = []
+    channel = None
+    error = None
+    try:
+        geo = mari.geo.current() if entity is None else index.geo(entity)
+        if geo is None:
+            raise ValueError("No geo named '%s'" %entity)
+        channel = index.channel(geo.name(), channel_name)
+        if channel is None:
+            channel = geo.createChannel(channel_name, rows[0]['resolution'], rows[0]['resolution'], rows[0]['depth'])
+            index.addChannel(geo, channel)
+        channel.makeCurrent()
+    except Exception, e:
+        error = str(e)
+    for row in rows:
+        start = time.time()
+        entry = {'entity' : entity, 'channel' : channel_name, 'layer' : row['layer'], 'path' : row['path'], 'files' : 0, 'seconds' : 0.0, 'error' : error}
+        if error is None:
+            try:
+                template, group = _manifestGroup(row)
+                entry['files'] = importGroup(channel, group, template, resize_options.index(row['resize']),
+                layer_import_options.index(row['layer_option']) + 1, row['only_changed'], row['compare_contents'], row['layer'])
+            except Exception, e:
+                entry['error'] = str(e)
+        entry['seconds'] = time.time() - start
+        entries.append(entry)
+    return entries
+
+# ------------------------------------------------------------------------------
+def _manifestGroup(row):
+    "Returns the ImportTemplate and ImportGroup for a manifest row's file pattern, raises ValueError if no files match."
+    directory, pattern = os.path.split(os.path.abspath(row['path']))
+    template = ImportTemplate(pattern)
+    import_groups = {}
+    files = directory_scanner.listDirectory(directory)[0]
+    for file_ in sorted(files):
+        match = template.match(file_)
+        if match is not None:
+            addImportFile(import_groups, match, directory, file_)
+    if len(import_groups) == 0:
+        raise ValueError("No files match '%s'" %row['path'])
+    group = import_groups.values()[0]
+    group.entity, group.channel, group.layer = row['entity'], row['channel'], row['layer']
+    return template, group
+
+# ------------------------------------------------------------------------------
+def _manifestReport(result):
+    "Returns a timing table of a manifest import."
+    lines = ['Import from manifest took %.1fs' %result['seconds']]
+    for entry in result['imports']:
+        name = ' : '.join([str(x) for x in (entry['entity'], entry['channel'], entry['layer']) if x is not None])
+        lines.append('%-60s %6d files %8.1fs %s' %(name, entry['files'], entry['seconds'], entry['error'] or ''))
+    return '\n'.join(lines)
+
+# ------------------------------------------------------------------------------
+def loadChangedUdims(channel, layer, record, old_record, changed):
+    """Load the changed UDIM files into the layer's images, UDIMs the geo has no patch for are skipped and a file that
+    fails to load keeps its old record so it is tried again next time. The record is updated to match what was loaded.
+    Returns the number of UDIMs loaded, or None if a file isn't the size of its patch and the group needs a full import."""
+    uv_indexes = set([patch.uvIndex() for patch in channel.geoEntity().patchList()])
+    probes = image_probe.probeImages([record[str(udim)][0] for udim in changed if udim - 1001 in uv_indexes])
+    for udim in changed:
+        probe = probes.get(record[str(udim)][0])
+        if udim - 1001 in uv_indexes and (probe is None or
+            (probe['width'], probe['height']) != (channel.width(udim - 1001), channel.height(udim - 1001))):
+            return None
+    image_set = layer.imageSet()
+    loaded = 0
+    for udim in changed:
+        path = record[str(udim)][0]
+        if udim - 1001 not in uv_indexes:
+            mari.app.log('Skipped "%s", the geo has no patch for UDIM %d' %(path, udim))
+            _keepOldRecord(record, old_record, udim)
+            continue
+        try:
+            image_set.image(udim - 1001).load(path)
+        except Exception, e:
+            mari.app.log('Failed to load "%s" into UDIM %d "%s"' %(path, udim, e))
+            _keepOldRecord(record, old_record, udim)
+            continue
+        loaded += 1
+    return loaded
+
+# ------------------------------------------------------------------------------
+def _keepOldRecord(record, old_record, udim):
+    "Put back the old record of a UDIM that wasn't loaded, or drop it if it had none."
+    if str(udim) in old_record:
+        record[str(udim)] = old_record[str(udim)]
+    else:
+        record.pop(str(udim), None)
+
+# ------------------------------------------------------------------------------
+def findLayer(channel, name):
+    "Returns the first paintable layer in the channel's layer stack with the name, or None."
+    for layer in channel.layerList():
+        if layer.name() == name and layer.isPaintableLayer():
+            return layer
+    return None
+
+# ------------------------------------------------------------------------------
+def readImportRecord(layer):
+    "Returns the layer's import record {udim : [path, size, mtime, hash]}, or None if it has not been imported into."
+    if layer is None or not layer.hasMetadata(import_record_key):
+        return None
+    try:
+        return json.loads(layer.metadata(import_record_key))
+    except ValueError:
+        return None
+
+# ------------------------------------------------------------------------------
+def writeImportRecord(layer, record):
+    "Store the import record as hidden layer metadata."
+    layer.setMetadata(import_record_key, json.dumps(record, sort_keys=True))
+    layer.setMetadataEnabled(import_record_key, False)
+
+# ------------------------------------------------------------------------------
+def currentImportRecord(group, compare_contents, old_record):
+    "Returns the import record for the group's files as they are on disk, hashes are only taken for files that changed size or time."
+    record = dict(old_record)
+    for file_, udim in zip(group.files, group.udims):
+        path = os.path.join(group.directory, file_)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        old = old_record.get(str(udim))
+        hash_ = None
+        if compare_contents:
+            if old is not None and old[:3] == [path, stat.st_size, stat.st_mtime] and old[3] is not None:
+                hash_ = old[3]
             else:
-                channel = mari.geo.current().createChannel(channel, channel_res, channel_res, channel_bit)
-                old_layer_list = channel.layerList()
-                channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-                layer_list = channel.layerList()
-                if len(old_layer_list) != len(layer_list):
-                    if '$LAYER' in template:
-                        ilay = template.index('$LAYER')
-                        layer_list[0].setName(image_template[ifile_][ilay])
-                    else:
-                        layer_list[0].setName(file_names_short[ifile_])
-                
-        elif '$LAYER' in template:
-            ilay = template.index('$LAYER')
-            channel = mari.geo.current().currentChannel()
-            old_layer_list = channel.layerList()
-            channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-            layer_list = channel.layerList()
-            if len(old_layer_list) != len(layer_list):
-                layer_list[0].setName(image_template[ifile_][ilay])
-            
+                hash_ = fileHash(path)
+        record[str(udim)] = [path, stat.st_size, stat.st_mtime, hash_]
+    return record
+
+# ------------------------------------------------------------------------------
+def changedUdims(old_record, record, compare_contents):
+    "Returns the UDIMs whose file is new, moved or changed size or time, with compare contents a file with the same hash is unchanged."
+    changed = []
+    for key, entry in record.items():
+        old = old_record.get(key)
+        if old is not None and old[0] == entry[0]:
+            if old[1:3] == entry[1:3]:
+                continue
+            if compare_contents and old[3] is not None and old[3] == entry[3]:
+                continue
+        changed.append(int(key))
+    return sorted(changed)
+
+# ------------------------------------------------------------------------------
+def fileHash(path, block_size=1024*1024):
+    "Returns the sha1 of a file's contents."
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file_:
+        for block in iter(lambda: file_.read(block_size), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+# ------------------------------------------------------------------------------
+def planChannelSizes(template, import_groups, index):
+    """Probe the image headers of every channel the import will create, on worker threads.
+    Returns {(geo name, channel name) : {'size', 'depth', 'udim_sizes'}}, the channel size is the most common UDIM size."""
+    texture_sizes = [QSize.width() for QSize in mari.images.supportedTextureSizes()]
+    new_channels = {}
+    for group in import_groups.values():
+        geo = index.geo(group.entity) if template.hasToken('$ENTITY') else mari.geo.current()
+        if template.hasToken('$CHANNEL'):
+            name = group.channel
+        elif template.hasToken('$ENTITY'):
+            name = group.name
         else:
-            channel = mari.geo.current().currentChannel()
-            old_layer_list = channel.layerList()
-            channel.importImages(os.path.join(file_paths[ifile_], import_template), resize_option, layer_option)
-            layer_list = channel.layerList()
-            if len(old_layer_list) != len(layer_list):
-                layer_list[0].setName(file_)
-                    
+            continue
+        if index.hasChannel(geo.name(), name):
+            continue
+        udims = group.udims if len(group.udims) == len(group.files) else [None] * len(group.files)
+        files = new_channels.setdefault((geo.name(), name), [])
+        files.extend([(os.path.join(group.directory, file_), udim) for file_, udim in zip(group.files, udims)])
+    if len(new_channels) == 0:
+        return {}
+
+    probes = image_probe.probeImages([path for files in new_channels.values() for path, udim in files])
+    channel_sizes = {}
+    for key, files in new_channels.items():
+        udim_sizes = {}
+        counts = {}
+        depth = 0
+        for path, udim in files:
+            probe = probes.get(path)
+            if probe is None:
+                continue
+            size = image_probe.textureSize(probe['width'], probe['height'], texture_sizes)
+            counts[size] = counts.get(size, 0) + 1
+            depth = max(depth, channelDepth(probe['depth']))
+            if udim is not None:
+                udim_sizes[udim] = size
+        if len(counts) == 0:
+            continue
+        size = max(sorted(counts), key=lambda x: counts[x])
+        channel_sizes[key] = {'size' : size, 'depth' : depth, 'udim_sizes' : udim_sizes}
+    return channel_sizes
+
+# ------------------------------------------------------------------------------
+def channelDepth(bits):
+    "Returns the Mari channel bit depth that holds an image's bits per channel."
+    for depth in channel_bit_depth_options:
+        if bits <= int(depth):
+            return int(depth)
+    return int(channel_bit_depth_options[-1])
+
+# ------------------------------------------------------------------------------
+def createImportChannel(geo, name, channel_sizes, channel_res, channel_bit):
+    "Creates a channel at the size and depth probed from its images, patches whose images are a different size are resized."
+    sizes = channel_sizes.get((geo.name(), name))
+    if sizes is None:
+        return geo.createChannel(name, channel_res, channel_res, channel_bit)
+    channel = geo.createChannel(name, sizes['size'], sizes['size'], sizes['depth'])
+    uv_indexes = set([patch.uvIndex() for patch in geo.patchList()])
+    resize = {}
+    for udim, size in sizes['udim_sizes'].items():
+        if size != sizes['size'] and udim - 1001 in uv_indexes:
+            resize.setdefault(size, []).append(udim - 1001)
+    failed = []
+    for size, uv_index_list in sorted(resize.items()):
+        try:
+            channel.resize(size, sorted(uv_index_list))
+        except Exception, e:
+            mari.app.log('Failed to resize %s : %s UDIMs %s to %d "%s"' %(geo.name(), name, [x + 1001 for x in sorted(uv_index_list)], size, e))
+            failed.extend([x + 1001 for x in uv_index_list])
+    if failed:
+        mari.utils.message("Channel '%s' was created at %d but UDIMs %s could not be resized to match their images, see the log for details."
+            %(name, sizes['size'], ', '.join([str(udim) for udim in sorted(failed)])))
+    return channel
+
+# ------------------------------------------------------------------------------
+class ImportTemplate(object):
+    "An import template compiled into one anchored regex, each token becomes a named group."
+    def __init__(self, template):
+        self.template = template
+        self.type = None
+        for type_ in image_file_types:
+            if template.endswith(type_):
+                self.type = type_
+                break
+        if self.type is None:
+            raise ValueError("File type is not supported: '%s'" %template)
+        self.stem = template[:-len(self.type)]
+        self.tokens = [token for token in tokens if token in self.stem]
+        self.regex = re.compile(self._pattern() + r'\Z')
+
+    def _pattern(self):
+        "Returns the regex for the template without its file type, a token used twice must match the same text."
+        pattern = ''
+        used = set()
+        for part in re.split(r'(\$ENTITY|\$CHANNEL|\$LAYER|\$UDIM)', self.stem):
+            if part not in token_groups:
+                pattern += re.escape(part)
+            elif part in used:
+                pattern += '(?P=%s)' %token_groups[part]
+            elif part == '$UDIM':
+                pattern += r'(?P<udim>\d{4})'
+                used.add(part)
+            else:
+                pattern += '(?P<%s>.+?)' %token_groups[part]
+                used.add(part)
+        return pattern
+
+    def hasToken(self, token):
+        "Returns True if the template uses the token."
+        return token in self.tokens
+
+    def match(self, file_name):
+        "Returns the regex match for a file name, or None if the file doesn't match the template."
+        if not file_name.lower().endswith(self.type.lower()):
+            return None
+        return self.regex.match(file_name[:-len(self.type)])
+
+    def importPath(self, group):
+        "Returns the path to import a group from, every token except $UDIM is filled in."
+        path = self.template
+        for token, value in (('$ENTITY', group.entity), ('$CHANNEL', group.channel), ('$LAYER', group.layer)):
+            if value is not None:
+                path = path.replace(token, value)
+        return os.path.join(group.directory, path)
+
+# ------------------------------------------------------------------------------
+class ImportGroup(object):
+    "The files for one (entity, channel, layer), the UDIMs of one image name."
+    def __init__(self, entity, channel, layer, name, directory):
+        self.entity = entity
+        self.channel = channel
+        self.layer = layer
+        self.name = name
+        self.directory = directory
+        self.files = []
+        self.udims = []
+
+# ------------------------------------------------------------------------------
+def addImportFile(import_groups, match, directory, file_name):
+    "Adds a matched file to its (entity, channel, layer) group, the first directory found for a group is used."
+    values = match.groupdict()
+    key = (values.get('entity'), values.get('channel'), values.get('layer'))
+    if key not in import_groups:
+        import_groups[key] = ImportGroup(key[0], key[1], key[2], _imageName(match), directory)
+    group = import_groups[key]
+    if directory != group.directory:
+        return
+    group.files.append(file_name)
+    if values.get('udim') is not None:
+        group.udims.append(int(values['udim']))
+
+# ------------------------------------------------------------------------------
+def _imageName(match):
+    "Returns the matched file name without its file type and UDIM, along with the UDIM's separator."
+    name = match.string
+    if 'udim' not in match.groupdict():
+        return name
+    start, end = match.span('udim')
+    if start > 0 and name[start - 1] in '._':
+        start -= 1
+    elif end < len(name) and name[end] in '._':
+        end += 1
+    return name[:start] + name[end:]
+
 # ------------------------------------------------------------------------------
 def isProjectSuitable():
     "Checks project state."
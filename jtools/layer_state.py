@@ -0,0 +1,148 @@
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Snapshot and restore channel and layer lock and cache state
+# coding: utf-8
+# Written by Jorel Latraille
+# ------------------------------------------------------------------------------
+# DISCLAIMER & TERMS OF USE:
+#
+# Copyright (c) The Foundry 2014.
+# All rights reserved.
+#
+# This software is provided as-is with use in commercial projects permitted.
+# Redistribution in commercial projects is also permitted
+# provided that the above copyright notice and this paragraph are
+# duplicated in accompanying documentation,
+# and acknowledge that the software was developed
+# by The Foundry.  The name of the
+# The Foundry may not be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND WITHOUT ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+import mari
+
+version = "0.01"
+
+UNCACHE_ACTION = '/Mari/Layers/Uncache Layer'
+CACHE_ACTION = '/Mari/Layers/Cache Layer'
+
+# ------------------------------------------------------------------------------
+class LayerState(object):
+    """Records the state of every channel and layer it changes so an operation only changes what it needs,
+    restore puts everything back in one pass, e.g.
+        state = LayerState()
+        try:
+            state.unlockLayers(layers)
+            ...
+        finally:
+            state.restore()"""
+
+    def __init__(self):
+        self.changes = []
+        self.failed = []
+        self._changed = set()
+        self._selection = _currentSelection()
+
+    def unlockChannels(self, channels):
+        "Unlocks the locked channels."
+        for channel in channels:
+            if channel.isLocked():
+                self._change(channel, 'locked', True, lambda x: x.setLocked(False))
+
+    def unlockLayers(self, layers):
+        "Unlocks the locked layers."
+        for layer in layers:
+            if layer.isLocked():
+                self._change(layer, 'locked', True, lambda x: x.setLocked(False))
+
+    def uncacheLayers(self, layers):
+        "Uncaches the cached layers, the current layer only changes if Mari has no uncache method."
+        for layer in layers:
+            if layer.isLayerCached():
+                self._change(layer, 'cached', True, _uncacheLayer)
+
+    def restore(self):
+        "Puts back every change in reverse order, a change that fails is logged and the rest are still restored. Returns the failures."
+        failed = []
+        for obj, state, value in reversed(self.changes):
+            try:
+                _RESTORE[state](obj, value)
+            except Exception, e:
+                failed.append((obj.name(), state, str(e)))
+                mari.app.log('Failed to restore %s of "%s" %s' %(state, obj.name(), e))
+        self.changes = []
+        self._changed = set()
+        _restoreSelection(self._selection)
+        self.failed.extend(failed)
+        return failed
+
+    def _change(self, obj, state, value, changeFn):
+        "Records the original value the first time an object's state is changed, then changes it."
+        if (obj, state) in self._changed:
+            return
+        changeFn(obj)
+        self._changed.add((obj, state))
+        self.changes.append((obj, state, value))
+
+# ------------------------------------------------------------------------------
+def _uncacheLayer(layer):
+    "Uncache a layer, with the Uncache Layer action for Mari versions without Layer.uncacheLayer."
+    if hasattr(layer, 'uncacheLayer'):
+        layer.uncacheLayer()
+    else:
+        layer.makeCurrent()
+        mari.actions.get(UNCACHE_ACTION).trigger()
+
+# ------------------------------------------------------------------------------
+def _cacheLayer(layer):
+    "Cache a layer, with the Cache Layer action for Mari versions without Layer.cacheLayer."
+    if hasattr(layer, 'cacheLayer'):
+        layer.cacheLayer()
+    else:
+        layer.makeCurrent()
+        mari.actions.get(CACHE_ACTION).trigger()
+
+# ------------------------------------------------------------------------------
+def _restoreCached(layer, cached):
+    "Caches or uncaches the layer unless it is already in that state."
+    if layer.isLayerCached() != cached:
+        if cached:
+            _cacheLayer(layer)
+        else:
+            _uncacheLayer(layer)
+
+_RESTORE = {
+'locked' : lambda obj, value: obj.setLocked(value),
+'cached' : _restoreCached
+}
+
+# ------------------------------------------------------------------------------
+def _currentSelection():
+    "Returns the current geo, channel and layer so they can be made current again."
+    geo = mari.geo.current()
+    if geo is None:
+        return (None, None, None)
+    channel = geo.currentChannel()
+    if channel is None:
+        return (geo, None, None)
+    return (geo, channel, channel.currentLayer())
+
+# ------------------------------------------------------------------------------
+def _restoreSelection(selection):
+    "Makes the geo, channel and layer current again if uncaching or caching changed them."
+    geo, channel, layer = selection
+    if _currentSelection() == selection:
+        return
+    try:
+        if geo is not None:
+            mari.geo.setCurrent(geo)
+        if channel is not None:
+            geo.setCurrentChannel(channel)
+        if layer is not None:
+            layer.makeCurrent()
+    except Exception, e:
+        mari.app.log('Failed to restore the current layer %s' %e)
@@ -23,7 +23,8 @@
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
 
-import mari, os
+import mari, os, sys, shutil, tempfile, threading, Queue, hashlib, json, socket, time
+import image_probe
 import PySide.QtGui as QtGui
 import PySide.QtCore as QtCore
 
@@ -33,6 +34,37 @@ lighting_mode_list = ['Flat', 'Basic', 'Full']
 color_depth_list = ['8bit (Byte)', '16bit (Half)', '32bit (Float)']
 size_list = ['2048 x 2048', '4096 x 4096', '8192 x 8192', '16384 x 16384', '32768 x 32768']
 
+WRITE_QUEUE_SIZE = 4    # frames unprojected ahead of the writer thread, each holds a frame on the local disk
+TRUNCATED_FRACTION = 0.5    # finished frames smaller than this fraction of the median frame size are rendered again
+FRAME_STATE_GETTERS = ['translation', 'lookAt', 'up', 'fieldOfView', 'orthoSize', 'nearClip', 'farClip', 'cameraType']
+GEO_STATE_GETTERS = ['translation', 'rotation', 'scale', 'transform', 'isVisible']
+ANIMATION_GETTERS = ['isAnimated', 'hasAnimation', 'frameNumbers']   # truthy or more than one frame if the object animates
+
+# A playblast job lives in a directory next to the frames, it holds the job file, a lock file for each
+# claim of a shard and a done file for each finished shard. A shard is claimed by creating the next
+# generation of its lock file, so only one session can claim it, and a lock that hasn't been touched for
+# LOCK_TIMEOUT seconds belongs to a crashed session and the shard is claimed again.
+PLAYBLAST_JOB_PREFIX = '.jtools_playblast_'
+PLAYBLAST_JOB_FILENAME = 'job.json'
+SHARD_SIZE = 25
+LOCK_TIMEOUT = 30 * 60     # seconds without a finished frame before a shard is re-issued
+JOB_POLL_INTERVAL = 30     # seconds between checks for re-issued shards while waiting
+
+# ------------------------------------------------------------------------------
+class PlayblastJobError(Exception):
+    "Raised when a playblast job can't be read or run."
+    pass
+
+# ------------------------------------------------------------------------------
+class ShardLostError(PlayblastJobError):
+    "Raised when another session has claimed the shard being rendered."
+    pass
+
+# ------------------------------------------------------------------------------
+class PlayblastJobExistsError(PlayblastJobError):
+    "Raised when a new job would replace a job that sessions have already claimed or finished shards of."
+    pass
+
 # ------------------------------------------------------------------------------
 class playblastUI(QtGui.QDialog):
     "Create ImportImagesUI"
@@ -130,6 +162,24 @@ class playblastUI(QtGui.QDialog):
         for size in size_list:
             self._size.addItem(size)
         self._size.setCurrentIndex(self._size.findText(([bit for bit in size_list if str(self.original_size) in bit])[0]))
+        background_write_label = QtGui.QLabel('Write in background:')
+        self.background_write = QtGui.QCheckBox()
+        self.background_write.setToolTip('Unproject each frame to the local temp directory and copy it to the path on a background thread')
+        self.background_write.setChecked(True)
+        skip_finished_label = QtGui.QLabel('Skip finished frames:')
+        self.skip_finished = QtGui.QCheckBox()
+        self.skip_finished.setToolTip('Only unproject frames that are missing from the path or are not complete images')
+        reuse_held_label = QtGui.QLabel('Reuse held frames:')
+        self.reuse_held = QtGui.QCheckBox()
+        self.reuse_held.setToolTip('Copy the previous frame instead of unprojecting when the camera, projector and geo transforms and versions '
+            'have not changed. Animated geo or textures that Mari does not report as animated are not detected, leave this off for them')
+        split_job_label = QtGui.QLabel('Split into shards:')
+        self.split_job = QtGui.QCheckBox()
+        self.split_job.setToolTip('Write a job that Mari sessions render a shard at a time with mari.jtools.playblastWorker()')
+        self.shard_size = QtGui.QLineEdit()
+        self.shard_size.setValidator(QtGui.QIntValidator(1, 1000000, self))
+        self.shard_size.setText(str(SHARD_SIZE))
+        self.shard_size.setToolTip('Frames per shard')
 
         #Create unproject_layout
         unproject_layout = QtGui.QGridLayout()
@@ -144,6 +194,15 @@ class playblastUI(QtGui.QDialog):
         unproject_layout.addWidget(self.color_depth, 3, 1, QtCore.Qt.AlignLeft)
         unproject_layout.addWidget(size_label, 4, 0, QtCore.Qt.AlignRight)
         unproject_layout.addWidget(self._size, 4, 1, QtCore.Qt.AlignLeft)
+        unproject_layout.addWidget(background_write_label, 5, 0, QtCore.Qt.AlignRight)
+        unproject_layout.addWidget(self.background_write, 5, 1, QtCore.Qt.AlignLeft)
+        unproject_layout.addWidget(skip_finished_label, 6, 0, QtCore.Qt.AlignRight)
+        unproject_layout.addWidget(self.skip_finished, 6, 1, QtCore.Qt.AlignLeft)
+        unproject_layout.addWidget(reuse_held_label, 7, 0, QtCore.Qt.AlignRight)
+        unproject_layout.addWidget(self.reuse_held, 7, 1, QtCore.Qt.AlignLeft)
+        unproject_layout.addWidget(split_job_label, 8, 0, QtCore.Qt.AlignRight)
+        unproject_layout.addWidget(self.split_job, 8, 1, QtCore.Qt.AlignLeft)
+        unproject_layout.addWidget(self.shard_size, 8, 2, QtCore.Qt.AlignLeft)
         unproject_layout.setColumnStretch(1, 1)
         unproject_layout.setColumnStretch(2, 1)
         unproject_layout.setColumnStretch(3, 1)
@@ -255,6 +314,9 @@ class playblastUI(QtGui.QDialog):
         if not path_template.endswith(tuple(file_types)):
             mari.utils.message("File type is not supported: '%s'" %(os.path.split(path_template)[1]))
             return
+        if self.split_job.isChecked() and self.shard_size.text() == '':
+            mari.utils.message("Please provide the number of frames per shard.")
+            return
 
         self.accept()
 
@@ -321,6 +383,24 @@ class playblastUI(QtGui.QDialog):
         "Return path"
         return self.path.text()
 
+    def _getBackgroundWrite(self):
+        "Return background write setting"
+        return self.background_write.isChecked()
+
+    def _getSkipFinished(self):
+        "Return skip finished frames setting"
+        return self.skip_finished.isChecked()
+
+    def _getReuseHeld(self):
+        "Return reuse held frames setting"
+        return self.reuse_held.isChecked()
+
+    def _getShardSize(self):
+        "Return frames per shard, or None if the playblast isn't split into shards"
+        if not self.split_job.isChecked():
+            return None
+        return int(self.shard_size.text())
+
 # ------------------------------------------------------------------------------
 class makeDirUI(QtGui.QDialog):
     "Create ImportImagesUI"
@@ -369,7 +449,7 @@ def playblast():
     dialog = playblastUI()
     if dialog.exec_():
         #Get all inputs/settings from dialog
-        time = dialog._getTime()
+        use_timeline = dialog._getTime()
         original_start_end_time = dialog._getOriginalStartEndTime()
         start_end_time = dialog._getStartEndTime()
         frame_padding = dialog._getFramePadding()
@@ -384,68 +464,525 @@ def playblast():
         original_size = dialog._getOriginalSize()
         _size = dialog._getSize()
         path_template = dialog._getPath()
+        background_write = dialog._getBackgroundWrite()
+        skip_finished = dialog._getSkipFinished()
+        reuse_held = dialog._getReuseHeld()
+        shard_size = dialog._getShardSize()
 
         #Get the current projector and its export path
         projector = mari.projectors.current()
         original_path = projector.exportPath()
 
         #Setup the projector using the input/settings from the dialog
-        projector.setClampColors(clamp)
-        projector.setUseShader(shader)
-        projector.setLightingMode(lighting_mode)
         if '8' in color_depth:
-            projector.setBitDepth(8)
+            bit_depth = 8
         elif '16' in color_depth:
-            projector.setBitDepth(16)
+            bit_depth = 16
         else:
-            projector.setBitDepth(32)
-        size = _size.split('x')
-        projector.setSize(int(size[0]), int(size[1]))
-        
-        #Get the path and template
-        path = os.path.split(path_template)[0]
-        template = os.path.split(path_template)[1]
+            bit_depth = 32
+        settings = {
+        'clamp' : clamp,
+        'shader' : shader,
+        'lighting_mode' : lighting_mode,
+        'bit_depth' : bit_depth,
+        'size' : int(_size.split('x')[0])
+        }
+
+        #Write a job for Mari sessions to render instead of rendering here
+        if shard_size is not None:
+            job_args = (projector, path_template, int(start_end_time[0]), int(start_end_time[1]), frame_padding, settings,
+                shard_size, background_write, reuse_held)
+            try:
+                try:
+                    job_path = createPlayblastJob(*job_args)
+                except PlayblastJobExistsError, e:
+                    replace = QtGui.QMessageBox.question(None, 'Replace Playblast Job', '%s\nReplace it? Sessions still rendering it will stop.' %str(e),
+                        QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+                    if replace != QtGui.QMessageBox.Yes:
+                        return
+                    job_path = createPlayblastJob(*job_args, replace=True)
+            except (PlayblastJobError, IOError, OSError), e:
+                mari.utils.message("Unable to write playblast job: '%s'" %str(e))
+                return
+            mari.utils.message("Playblast job written to '%s'\nSave the project, then render it in this or other Mari sessions with mari.jtools.playblastWorker(r'%s')" %(job_path, job_path))
+            return
 
+        applyProjectorSettings(projector, settings)
+        
         #Throw the export process into a try, just in case writing to disk fails
         #Use the input/settings from the dialog to decide whether to use the current time slider numbers or not
-        #Itterate through the frame range and export accordingly, also use zfill to pad the numbers
+        #The frames already handed to the writer are still written if unprojecting fails
+        writer = FrameWriter() if background_write else None
         try:
-            if time:
-                mari.clock.rewind()
-                for frame in range(int(start_end_time[0]), int(start_end_time[1]) + 1):
-                    frame = str(frame).zfill(frame_padding)
-                    projector.unprojectToFile(os.path.join(path, template.replace('$FRAME', frame)))
-                    mari.clock.stepForward()
-
-            else:
+            if not use_timeline:
                 mari.clock.setFrameRange(int(start_end_time[0]), int(start_end_time[1]))
-                mari.clock.rewind()
-                for frame in range(int(start_end_time[0]), int(start_end_time[1]) + 1):
-                    frame = str(frame).zfill(frame_padding)
-                    projector.unprojectToFile(os.path.join(path, template.replace('$FRAME', frame)))
-                    mari.clock.stepForward()
-        
-            #Reset the projector and time slider back to its original settings
-            projector.setClampColors(original_clamp)
-            projector.setUseShader(original_shader)
-            projector.setLightingMode(original_mode)
-            projector.setBitDepth(original_depth)
-            projector.setSize(original_size, original_size)
-            projector.setExportPath(original_path)
-            mari.clock.setFrameRange(original_start_end_time[0], original_start_end_time[1])
-            mari.clock.rewind()
-
+            counts = _renderWithWriter(writer, renderFrames, projector, int(start_end_time[0]), int(start_end_time[1]),
+                path_template, frame_padding, writer, skip_finished, reuse_held)
+            mari.app.log('Playblast unprojected %(rendered)d frames, skipped %(skipped)d finished frames and reused %(reused)d held frames' %counts)
         except Exception, e:
-            #Reset the projector and time slider back to its original settings
             mari.utils.message("Playblast failed: '%s'" %str(e))
-            projector.setClampColors(original_clamp)
-            projector.setUseShader(original_shader)
-            projector.setLightingMode(original_mode)
-            projector.setBitDepth(original_depth)
-            projector.setSize(original_size, original_size)
-            projector.setExportPath(original_path)
-            mari.clock.setFrameRange(original_start_end_time[0], original_start_end_time[1])
+        
+        #Reset the projector and time slider back to its original settings
+        applyProjectorSettings(projector, {
+        'clamp' : original_clamp,
+        'shader' : original_shader,
+        'lighting_mode' : original_mode,
+        'bit_depth' : original_depth,
+        'size' : original_size
+        })
+        projector.setExportPath(original_path)
+        mari.clock.setFrameRange(original_start_end_time[0], original_start_end_time[1])
+        mari.clock.rewind()
+
+# ------------------------------------------------------------------------------
+def framePath(path_template, frame, frame_padding):
+    "Returns the path of a frame, the frame number is padded with zfill."
+    path, template = os.path.split(path_template)
+    return os.path.join(path, template.replace('$FRAME', str(frame).zfill(frame_padding)))
+
+# ------------------------------------------------------------------------------
+def renderFrames(projector, start, end, path_template, frame_padding, writer=None, skip_finished=False, reuse_held=False, frameFn=None):
+    """Unproject every frame from the start of the time slider, frames go through the writer if one is given.
+    skip_finished leaves frames that are already complete on disk, reuse_held copies the previous frame when
+    the camera and projector state hasn't changed, frameFn(path) is called after each frame and can raise to stop.
+    Returns the number of frames rendered, skipped and reused."""
+    counts = {'rendered' : 0, 'skipped' : 0, 'reused' : 0}
+    paths = [framePath(path_template, frame, frame_padding) for frame in range(start, end + 1)]
+    finished = set()
+    if skip_finished:
+        finished = findFinishedFrames(paths, projector.width(), projector.height())
+    animated = False
+    if reuse_held:
+        animated = sceneIsAnimated()
+        if animated:
+            mari.app.log('Playblast will not reuse held frames, the project has animated geo or channels')
+    previous_path = None
+    previous_state = None
+    mari.clock.rewind()
+    for frame, path in zip(range(start, end + 1), paths):
+        state = frameState(projector, frame, animated) if reuse_held else None
+        if path in finished:
+            counts['skipped'] += 1
+        elif state is not None and state == previous_state:
+            #The held frame is copied after the previous frame, the writer writes frames in order
+            if writer is None:
+                writeFrame(previous_path, path)
+            else:
+                writer.add(previous_path, path, remove_source=False)
+            counts['reused'] += 1
+        elif writer is None:
+            projector.unprojectToFile(path)
+            counts['rendered'] += 1
+        else:
+            scratch_path = writer.scratchPath(path)
+            projector.unprojectToFile(scratch_path)
+            writer.add(scratch_path, path)
+            counts['rendered'] += 1
+        previous_path = path
+        previous_state = state
+        if frameFn is not None:
+            frameFn(path)
+        mari.clock.stepForward()
+    return counts
+
+# ------------------------------------------------------------------------------
+def findFinishedFrames(paths, width, height):
+    """Returns the paths that hold a complete frame, the image header must match the projector size and
+    the file can't be much smaller than the other frames, which catches frames cut off while writing."""
+    existing = [path for path in paths if os.path.isfile(path)]
+    sizes = dict([(path, os.path.getsize(path)) for path in existing])
+    if not sizes:
+        return set()
+    median_size = sorted(sizes.values())[len(sizes) // 2]
+    probes = image_probe.probeImages(existing)
+    finished = set()
+    for path in existing:
+        probe = probes.get(path)
+        if probe is None or probe['width'] != width or probe['height'] != height:
+            mari.app.log('Playblast frame will be rendered again, the image is not valid or not the projector size "%s"' %path)
+        elif sizes[path] < median_size * TRUNCATED_FRACTION:
+            mari.app.log('Playblast frame will be rendered again, the file looks truncated "%s"' %path)
+        else:
+            finished.add(path)
+    return finished
+
+# ------------------------------------------------------------------------------
+def frameState(projector, frame=None, animated=False):
+    """Returns a hash of the projector, current camera and geo state at the current frame, None if it can't be read or
+    none of the camera state is available. Each geo adds its transform, visibility and current version, when the scene
+    is animated the frame number is added too so no frame matches the one before."""
+    objects = [projector]
+    canvas = mari.canvases.current()
+    if canvas is not None:
+        objects.append(canvas.camera())
+    md5 = hashlib.md5()
+    values_read = 0
+    try:
+        for obj in objects:
+            for name in FRAME_STATE_GETTERS:
+                if hasattr(obj, name):
+                    md5.update('%s=%r;' %(name, _stateValue(getattr(obj, name)())))
+                    values_read += 1
+        for geo in mari.geo.list():
+            md5.update('geo=%s;' %geo.name())
+            for name in GEO_STATE_GETTERS:
+                if hasattr(geo, name):
+                    md5.update('%s=%r;' %(name, _stateValue(getattr(geo, name)())))
+            if hasattr(geo, 'currentVersion') and geo.currentVersion() is not None:
+                md5.update('version=%s;' %geo.currentVersion().name())
+    except Exception, e:
+        mari.app.log('Unable to read the camera or geo state, frames will not be reused %s' %e)
+        return None
+    if values_read == 0:
+        return None
+    if animated:
+        md5.update('frame=%s;' %frame)
+    return md5.hexdigest()
+
+# ------------------------------------------------------------------------------
+def sceneIsAnimated():
+    "Returns True if any geo, geo version or channel reports that it animates through ANIMATION_GETTERS."
+    for geo in mari.geo.list():
+        objects = [geo] + list(geo.channelList())
+        if hasattr(geo, 'currentVersion') and geo.currentVersion() is not None:
+            objects.append(geo.currentVersion())
+        for obj in objects:
+            for name in ANIMATION_GETTERS:
+                if not hasattr(obj, name):
+                    continue
+                try:
+                    value = getattr(obj, name)()
+                except Exception:
+                    continue
+                if (isinstance(value, (list, tuple)) and len(value) > 1) or (not isinstance(value, (list, tuple)) and value):
+                    return True
+    return False
+
+# ------------------------------------------------------------------------------
+def _stateValue(value):
+    "Returns vectors as a tuple of their components so they compare by value."
+    if hasattr(value, 'x') and hasattr(value, 'y'):
+        components = [value.x(), value.y()]
+        for name in ('z', 'w'):
+            if hasattr(value, name):
+                components.append(getattr(value, name)())
+        return tuple(components)
+    return value
+
+# ------------------------------------------------------------------------------
+class FrameWriter(object):
+    """Copies unprojected frames from the local temp directory to their paths on a background thread,
+    so the next frame is unprojected while the last one is written to the file server. The queue is
+    bounded so unprojecting waits for the writer rather than filling the local disk. Mari objects
+    are never used on the writer thread."""
+    def __init__(self, queue_size=WRITE_QUEUE_SIZE):
+        self.error = None
+        self._count = 0
+        self._scratch_dir = tempfile.mkdtemp(prefix='jtools_playblast_')
+        self._queue = Queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def scratchPath(self, path):
+        "Returns a unique path in the local temp directory with the same file type as path."
+        self._count += 1
+        return os.path.join(self._scratch_dir, '%d%s' %(self._count, os.path.splitext(path)[1]))
+
+    def add(self, source, path, remove_source=True):
+        "Queue a frame to write, waits while the queue is full. Raises the writer's error if a write failed."
+        if self.error is not None:
+            raise self.error
+        self._queue.put((source, path, remove_source))
+
+    def finish(self, raise_error=True):
+        """Wait for every queued frame to be written and remove the temp directory. Raises the writer's error if a write
+        failed, or only logs it when raise_error is False."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            shutil.rmtree(self._scratch_dir, ignore_errors=True)
+        if self.error is not None:
+            if raise_error:
+                raise self.error
+            mari.app.log('Playblast failed to write a frame "%s"' %self.error)
+
+    def _work(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            source, path, remove_source = entry
+            #Once a write fails the remaining frames are dropped so unprojecting never waits on a full queue,
+            #any exception is kept rather than ending the thread
+            try:
+                if self.error is None:
+                    writeFrame(source, path)
+            except Exception, e:
+                self.error = e
+            try:
+                if remove_source and os.path.exists(source):
+                    os.remove(source)
+            except Exception, e:
+                if self.error is None:
+                    self.error = e
+
+# ------------------------------------------------------------------------------
+def _renderWithWriter(writer, renderFn, *args):
+    """Returns renderFn(*args) then waits for the writer. If rendering fails the writer's own error is only logged,
+    so the exception that stopped rendering is the one raised."""
+    try:
+        result = renderFn(*args)
+    except Exception:
+        exc_info = sys.exc_info()
+        if writer is not None:
+            writer.finish(raise_error=False)
+        raise exc_info[0], exc_info[1], exc_info[2]
+    if writer is not None:
+        writer.finish()
+    return result
+
+# ------------------------------------------------------------------------------
+def writeFrame(source, path):
+    """Copy a frame to a temporary name next to path then rename it, so a frame on disk is never half written.
+    The temporary name is unique to the host and process as sessions can write the same frame of a re-issued shard."""
+    part_path = '%s.%s.%d.part' %(path, socket.gethostname(), os.getpid())
+    shutil.copyfile(source, part_path)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part_path, path)
+
+# ------------------------------------------------------------------------------
+def projectorSettings(projector):
+    "Returns the projector's unproject settings as a dict that can be saved in a job file."
+    return {
+    'clamp' : projector.clampColors(),
+    'shader' : projector.useShader(),
+    'lighting_mode' : projector.lightingMode(),
+    'bit_depth' : projector.bitDepth(),
+    'size' : projector.width()
+    }
+
+# ------------------------------------------------------------------------------
+def applyProjectorSettings(projector, settings):
+    "Set the projector's unproject settings from a dict returned by projectorSettings."
+    projector.setClampColors(settings['clamp'])
+    projector.setUseShader(settings['shader'])
+    projector.setLightingMode(settings['lighting_mode'])
+    projector.setBitDepth(settings['bit_depth'])
+    projector.setSize(settings['size'], settings['size'])
+
+# ------------------------------------------------------------------------------
+def createPlayblastJob(projector, path_template, start, end, frame_padding, settings, shard_size=SHARD_SIZE, background_write=True, reuse_held=False, replace=False):
+    """Write a job file that splits the frame range into shards of shard_size frames and returns its path.
+    The job is written to a directory next to the frames. An existing job for the same path template that no session
+    has claimed a shard of is replaced, otherwise PlayblastJobExistsError is raised unless replace is True."""
+    if end < start:
+        raise PlayblastJobError('The end frame %d is before the start frame %d.' %(end, start))
+    job_dir = playblastJobDir(path_template)
+    if os.path.exists(job_dir):
+        shard_files = [name for name in os.listdir(job_dir) if name.startswith('shard_')]
+        if shard_files and not replace:
+            done = len([name for name in shard_files if name.endswith('.done')])
+            claimed = len(set([name.split('.')[0] for name in shard_files if name.endswith('.lock')]))
+            raise PlayblastJobExistsError("The playblast job in '%s' has %d shards claimed by sessions, %d of them finished." %(job_dir, claimed, done))
+        shutil.rmtree(job_dir)
+    os.makedirs(job_dir)
+    project = mari.projects.current()
+    job = {
+    'created' : time.strftime('%Y-%m-%d %H:%M:%S'),
+    'project' : project.uuid(),
+    'project_name' : project.name(),
+    'projector' : projector.name(),
+    'path' : path_template,
+    'frame_padding' : frame_padding,
+    'start' : start,
+    'end' : end,
+    'shards' : [[frame, min(frame + shard_size - 1, end)] for frame in range(start, end + 1, shard_size)],
+    'settings' : settings,
+    'background_write' : background_write,
+    'reuse_held' : reuse_held,
+    'lock_timeout' : LOCK_TIMEOUT
+    }
+    job_path = os.path.join(job_dir, PLAYBLAST_JOB_FILENAME)
+    _writeJson(job_path, job)
+    return job_path
+
+# ------------------------------------------------------------------------------
+def playblastJobDir(path_template):
+    "Returns the job directory for a path template, e.g. /out/.jtools_playblast_turntable for /out/turntable.$FRAME.tif"
+    path, template = os.path.split(path_template)
+    name = os.path.splitext(template)[0].replace('$FRAME', '').strip('._- ') or 'frames'
+    return os.path.join(path, PLAYBLAST_JOB_PREFIX + name)
+
+# ------------------------------------------------------------------------------
+def playblastWorker(job_path, wait=False):
+    """Render shards of a playblast job until none are left to claim, for the Python console or terminal mode Mari.
+    The job's project is opened if it isn't the current project. With wait the session keeps checking for shards
+    re-issued from crashed sessions until every shard is done. Returns a result dict."""
+    start_time = time.time()
+    result = {'success' : False, 'error' : None, 'seconds' : 0.0, 'shards' : [], 'lost' : [],
+    'rendered' : 0, 'skipped' : 0, 'reused' : 0}
+    try:
+        job = _readJson(job_path)
+        job_dir = os.path.dirname(os.path.abspath(job_path))
+        current = mari.projects.current()
+        if current is None or job['project'] not in (current.name(), current.uuid()):
+            mari.projects.open(job['project'])
+        projector = _findProjector(job['projector'])
+        original_settings = projectorSettings(projector)
+        original_range = (mari.clock.startFrame(), mari.clock.stopFrame())
+        applyProjectorSettings(projector, job['settings'])
+        try:
+            while True:
+                claim = _claimShard(job_dir, job)
+                if claim is None:
+                    if not wait or len(playblastJobStatus(job_path)['done']) == len(job['shards']):
+                        break
+                    time.sleep(JOB_POLL_INTERVAL)
+                    continue
+                index, generation = claim
+                try:
+                    counts = _renderShard(projector, job, job_dir, index, generation)
+                except ShardLostError, e:
+                    mari.app.log(str(e))
+                    result['lost'].append(index)
+                    continue
+                except Exception:
+                    #Release the shard so another session can claim it straight away
+                    _touch(_shardPath(job_dir, index, generation, 'released'))
+                    raise
+                result['shards'].append(index)
+                for key in counts:
+                    result[key] += counts[key]
+        finally:
+            applyProjectorSettings(projector, original_settings)
+            mari.clock.setFrameRange(original_range[0], original_range[1])
             mari.clock.rewind()
+        result['success'] = True
+    except Exception, e:
+        #Mari raises its own exceptions when unprojecting fails, the result is returned whatever went wrong
+        result['error'] = str(e)
+        mari.app.log('Playblast worker failed "%s"' %e)
+    result['seconds'] = time.time() - start_time
+    return result
+
+# ------------------------------------------------------------------------------
+def playblastJobStatus(job_path):
+    "Returns the indexes of the shards that are done, running and pending, pending includes shards from crashed sessions."
+    job = _readJson(job_path)
+    job_dir = os.path.dirname(os.path.abspath(job_path))
+    status = {'done' : [], 'running' : [], 'pending' : []}
+    files = set(os.listdir(job_dir))
+    for index in range(len(job['shards'])):
+        state = _shardState(job_dir, job, index, files)[0]
+        status['pending' if state == 'claimable' else state].append(index)
+    return status
+
+# ------------------------------------------------------------------------------
+def _renderShard(projector, job, job_dir, index, generation):
+    """Render the frames of a claimed shard then mark it done. A re-issued shard skips the frames its crashed session
+    finished, a first claim renders every frame so an earlier playblast to the same path is never kept."""
+    start, end = job['shards'][index]
+    lock_path = _shardPath(job_dir, index, generation, 'lock')
+    def frameFn(path):
+        #Touch the lock so other sessions know this one is alive, and stop if the shard was re-issued
+        if _latestGeneration(job_dir, index, set(os.listdir(job_dir))) != generation:
+            raise ShardLostError('Playblast shard %d was claimed by another session' %index)
+        os.utime(lock_path, None)
+    mari.clock.setFrameRange(start, end)
+    writer = FrameWriter() if job['background_write'] else None
+    counts = _renderWithWriter(writer, renderFrames, projector, start, end, job['path'], job['frame_padding'], writer,
+        generation > 1, job['reuse_held'], frameFn)
+    _writeJson(_shardPath(job_dir, index, None, 'done'), {
+    'host' : socket.gethostname(),
+    'pid' : os.getpid(),
+    'finished' : time.strftime('%Y-%m-%d %H:%M:%S'),
+    'frames' : counts
+    })
+    return counts
+
+# ------------------------------------------------------------------------------
+def _claimShard(job_dir, job):
+    "Claim the first shard that isn't done or running, returns (shard index, lock generation) or None."
+    files = set(os.listdir(job_dir))
+    for index in range(len(job['shards'])):
+        state, generation = _shardState(job_dir, job, index, files)
+        if state != 'claimable':
+            continue
+        lock_path = _shardPath(job_dir, index, generation + 1, 'lock')
+        try:
+            #O_EXCL fails if another session created this generation first
+            file_descriptor = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            continue
+        os.write(file_descriptor, json.dumps({'host' : socket.gethostname(), 'pid' : os.getpid(),
+        'claimed' : time.strftime('%Y-%m-%d %H:%M:%S')}))
+        os.close(file_descriptor)
+        return index, generation + 1
+    return None
+
+# ------------------------------------------------------------------------------
+def _shardState(job_dir, job, index, files):
+    "Returns ('done' | 'running' | 'claimable', latest lock generation) for a shard."
+    if os.path.basename(_shardPath(job_dir, index, None, 'done')) in files:
+        return 'done', None
+    generation = _latestGeneration(job_dir, index, files)
+    if generation == 0:
+        return 'claimable', generation
+    if os.path.basename(_shardPath(job_dir, index, generation, 'released')) in files:
+        return 'claimable', generation
+    try:
+        idle = time.time() - os.path.getmtime(_shardPath(job_dir, index, generation, 'lock'))
+    except OSError:
+        return 'claimable', generation
+    if idle > job.get('lock_timeout', LOCK_TIMEOUT):
+        return 'claimable', generation
+    return 'running', generation
+
+# ------------------------------------------------------------------------------
+def _latestGeneration(job_dir, index, files):
+    "Returns the highest lock generation of a shard, 0 if it has never been claimed."
+    prefix = 'shard_%04d.' %index
+    generations = [0]
+    for file_name in files:
+        if file_name.startswith(prefix) and file_name.endswith('.lock'):
+            try:
+                generations.append(int(file_name[len(prefix):-len('.lock')]))
+            except ValueError:
+                pass
+    return max(generations)
+
+# ------------------------------------------------------------------------------
+def _shardPath(job_dir, index, generation, extension):
+    "Returns the path of a shard's lock, released or done file, done files have no generation."
+    if generation is None:
+        return os.path.join(job_dir, 'shard_%04d.%s' %(index, extension))
+    return os.path.join(job_dir, 'shard_%04d.%d.%s' %(index, generation, extension))
+
+# ------------------------------------------------------------------------------
+def _findProjector(name):
+    "Returns the projector with the name."
+    for projector in mari.projectors.list():
+        if projector.name() == name:
+            return projector
+    raise PlayblastJobError("No projector named '%s'" %name)
+
+# ------------------------------------------------------------------------------
+def _touch(path):
+    with open(path, 'a'):
+        pass
+
+# ------------------------------------------------------------------------------
+def _readJson(path):
+    with open(path, 'r') as file_:
+        return json.load(file_)
+
+# ------------------------------------------------------------------------------
+def _writeJson(path, data):
+    with open(path, 'w') as file_:
+        json.dump(data, file_, indent=4, sort_keys=True)
 
 # ------------------------------------------------------------------------------
 def isProjectSuitable():
@@ -0,0 +1,177 @@
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Look up the project's geos and channels by name
+# coding: utf-8
+# Written by Jorel Latraille
+# ------------------------------------------------------------------------------
+# DISCLAIMER & TERMS OF USE:
+#
+# Copyright (c) The Foundry 2014.
+# All rights reserved.
+#
+# This software is provided as-is with use in commercial projects permitted.
+# Redistribution in commercial projects is also permitted
+# provided that the above copyright notice and this paragraph are
+# duplicated in accompanying documentation,
+# and acknowledge that the software was developed
+# by The Foundry.  The name of the
+# The Foundry may not be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND WITHOUT ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+import mari
+
+version = "0.01"
+
+# ------------------------------------------------------------------------------
+class ProjectIndex(object):
+    """Geos by name and their channels by name, built once per operation. While connected it is kept up to date by
+    Mari's geo and channel signals, e.g.
+        with ProjectIndex() as index:
+            channel = index.channel('body', 'diffuse')
+    A miss returns None without a rescan. A rename signal, or a hit whose object has since been renamed, invalidates
+    the project or the geo, and only the next miss rescans it."""
+    def __init__(self):
+        self._geos = {}
+        self._channels = {}
+        self._connected = []
+        self._connected_objects = set()
+        self._project_stale = False
+        self._stale_geos = set()
+        self.build()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.disconnect()
+
+    def build(self):
+        "Index every geo and channel in the project."
+        self._geos = {}
+        self._channels = {}
+        self._project_stale = False
+        self._stale_geos = set()
+        for geo in mari.geo.list():
+            self._addGeo(geo)
+
+    def connect(self):
+        "Keep the index up to date with Mari's signals until disconnect is called."
+        self._connect(mari.geo, 'entityMadeCurrent', self._addGeo)
+        self._connect(mari.geo, 'entityAdded', self._addGeo)
+        self._connect(mari.geo, 'entityRemoved', self._removeGeo)
+        for geo in self.geos():
+            self._connectGeo(geo)
+
+    def disconnect(self):
+        "Stop listening to Mari's signals."
+        for signal, slot in self._connected:
+            try:
+                mari.utils.disconnect(signal, slot)
+            except Exception:
+                pass
+        self._connected = []
+        self._connected_objects = set()
+
+    def geo(self, name):
+        "Returns the geo with the name, or None."
+        geo = self._geos.get(name)
+        if (geo is None and self._project_stale) or (geo is not None and geo.name() != name):
+            self.build()
+            geo = self._geos.get(name)
+        return geo
+
+    def geos(self):
+        "Returns every geo sorted by name."
+        return [self._geos[name] for name in sorted(self._geos)]
+
+    def geoNames(self):
+        "Returns the set of geo names."
+        return set(self._geos)
+
+    def channel(self, geo_name, channel_name):
+        "Returns the channel of the named geo with the name, or None."
+        geo = self.geo(geo_name)
+        if geo is None:
+            return None
+        channel = self._channels[geo_name].get(channel_name)
+        if (channel is None and geo_name in self._stale_geos) or (channel is not None and channel.name() != channel_name):
+            self._addGeo(geo)
+            channel = self._channels[geo_name].get(channel_name)
+        return channel
+
+    def hasChannel(self, geo_name, channel_name):
+        "Returns True if the named geo has a channel with the name."
+        return self.channel(geo_name, channel_name) is not None
+
+    def channels(self, geo_name=None):
+        "Returns the channels of the named geo, or of every geo, sorted by geo then channel name."
+        geo_names = sorted(self._channels) if geo_name is None else [geo_name]
+        channels = []
+        for name in geo_names:
+            geo_channels = self._channels.get(name, {})
+            channels.extend([geo_channels[key] for key in sorted(geo_channels, key=lambda x: x.lower())])
+        return channels
+
+    def addChannel(self, geo, channel):
+        "Add a channel created during the operation, for Mari versions without the channelAdded signal."
+        self._channels.setdefault(geo.name(), {})[channel.name()] = channel
+        if self._connected:
+            self._connectChannel(geo, channel)
+
+    def _addGeo(self, geo):
+        "Index or rescan a geo and its channels."
+        if geo is None:
+            return
+        self._geos[geo.name()] = geo
+        self._channels[geo.name()] = dict([(channel.name(), channel) for channel in geo.channelList()])
+        self._stale_geos.discard(geo.name())
+        if self._connected:
+            self._connectGeo(geo)
+
+    def _removeGeo(self, geo):
+        for name in [key for key, value in self._geos.items() if value == geo]:
+            del self._geos[name]
+            self._channels.pop(name, None)
+
+    def _connectGeo(self, geo):
+        if geo in self._connected_objects:
+            return
+        self._connected_objects.add(geo)
+        self._connect(geo, 'channelAdded', lambda channel, geo=geo: self.addChannel(geo, channel))
+        self._connect(geo, 'channelRemoved', lambda channel, geo=geo: self._removeChannel(geo, channel))
+        self._connect(geo, 'nameChanged', self._invalidateProject)
+        for channel in self._channels.get(geo.name(), {}).values():
+            self._connectChannel(geo, channel)
+
+    def _connectChannel(self, geo, channel):
+        if channel in self._connected_objects:
+            return
+        self._connected_objects.add(channel)
+        self._connect(channel, 'nameChanged', lambda *args, **kwargs: self._invalidateGeo(geo))
+
+    def _invalidateProject(self, *args, **kwargs):
+        "A geo was renamed, the next geo miss rebuilds the index."
+        self._project_stale = True
+
+    def _invalidateGeo(self, geo):
+        "A channel was renamed, the next channel miss on the geo rescans it."
+        self._stale_geos.add(geo.name())
+
+    def _removeChannel(self, geo, channel):
+        channels = self._channels.get(geo.name(), {})
+        for name in [key for key, value in channels.items() if value == channel]:
+            del channels[name]
+
+    def _connect(self, obj, signal_name, slot):
+        "Connect a slot to a signal if this Mari version has it."
+        if not hasattr(obj, signal_name):
+            return
+        signal = getattr(obj, signal_name)
+        mari.utils.connect(signal, slot)
+        self._connected.append((signal, slot))
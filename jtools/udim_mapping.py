@@ -0,0 +1,242 @@
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Parse UDIM selections and copy mappings for the patch tools
+# coding: utf-8
+# Written by Jorel Latraille
+# ------------------------------------------------------------------------------
+# DISCLAIMER & TERMS OF USE:
+#
+# Copyright (c) The Foundry 2014.
+# All rights reserved.
+#
+# This software is provided as-is with use in commercial projects permitted.
+# Redistribution in commercial projects is also permitted
+# provided that the above copyright notice and this paragraph are
+# duplicated in accompanying documentation,
+# and acknowledge that the software was developed
+# by The Foundry.  The name of the
+# The Foundry may not be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED ``AS IS'' AND WITHOUT ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+#
+# Selections are comma separated terms, UDIMs are selected in the order of the terms:
+#   1001              a single UDIM
+#   1001-1050         a range of UDIMs
+#   1001-1050x2       a range of UDIMs with a step
+#   u3, u1-3          one or more columns, 1 to 10
+#   v2, v2-5          one or more rows, row 1 is 1001-1010
+#   *                 every UDIM
+# Rows, columns and * only select UDIMs that exist, when no UDIMs are given the
+# whole UDIM space is used.
+#
+# Mappings pair a copy selection with either a paste selection of the same size,
+# or space separated transforms applied to every copy UDIM:
+#   +10, -1           offset the UDIM number
+#   u+1, v-2          move along the columns or rows
+#   flipu, flipv      mirror within the columns or rows of the copy selection
+# e.g. copy "v1-3" paste "v+1" moves the first three rows up one row.
+# ------------------------------------------------------------------------------
+
+import re
+
+version = "0.01"
+
+UDIM_START = 1001
+UDIM_END = 9999
+UDIM_COLUMNS = 10
+
+_RANGE_TERM = re.compile(r'^(\d{4})(?:-(\d{4})(?:x(\d+))?)?$')
+_ROW_COLUMN_TERM = re.compile(r'^([uv])(\d+)(?:-(\d+))?$')
+_OFFSET_TERM = re.compile(r'^([uv]?)([+-]\d+)$')
+_FLIP_TERM = re.compile(r'^flip([uv])$')
+
+# ------------------------------------------------------------------------------
+class UdimMappingError(ValueError):
+    "Raised when a UDIM selection or mapping can't be parsed or isn't valid."
+    pass
+
+# ------------------------------------------------------------------------------
+class UdimMapping(object):
+    "Ordered (copy UDIM, paste UDIM) pairs with checks for overlaps, chains and cycles."
+
+    def __init__(self, pairs):
+        self.pairs = [(copy_udim, paste_udim) for copy_udim, paste_udim in pairs if copy_udim != paste_udim]
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def copyUdims(self):
+        "Returns the UDIMs copied from."
+        return [copy_udim for copy_udim, paste_udim in self.pairs]
+
+    def pasteUdims(self):
+        "Returns the UDIMs pasted to."
+        return [paste_udim for copy_udim, paste_udim in self.pairs]
+
+    def indexPairs(self):
+        "Returns the pairs as (copy uv index, paste uv index)."
+        return [(copy_udim - UDIM_START, paste_udim - UDIM_START) for copy_udim, paste_udim in self.pairs]
+
+    def overlaps(self):
+        "Returns the UDIMs that more than one UDIM is pasted to."
+        seen = set()
+        overlapping = set()
+        for paste_udim in self.pasteUdims():
+            if paste_udim in seen:
+                overlapping.add(paste_udim)
+            seen.add(paste_udim)
+        return sorted(overlapping)
+
+    def chained(self):
+        "Returns the UDIMs that are pasted to and also copied from, their result depends on when they are read."
+        return sorted(set(self.copyUdims()) & set(self.pasteUdims()))
+
+    def cycles(self):
+        "Returns each cycle of UDIMs that are pasted onto each other, e.g. a swap of 1001 and 1002 is [1001, 1002]."
+        destination = dict(self.pairs)
+        cycles = []
+        visited = set()
+        for start in sorted(destination):
+            path = []
+            udim = start
+            while udim in destination and udim not in visited and udim not in path:
+                path.append(udim)
+                udim = destination[udim]
+            if udim in path:
+                cycles.append(path[path.index(udim):])
+            visited.update(path)
+        return cycles
+
+    def validate(self, available=None, snapshot=True):
+        "Raises UdimMappingError if UDIMs overlap or are missing, chains and cycles are only allowed if every copy UDIM is read before pasting."
+        if len(self.pairs) == 0:
+            raise UdimMappingError('The mapping does not copy any UDIMs.')
+        overlapping = self.overlaps()
+        if overlapping:
+            raise UdimMappingError('More than one UDIM is pasted to %s' %formatUdims(overlapping))
+        if available is not None:
+            missing = sorted((set(self.copyUdims()) | set(self.pasteUdims())) - set(available))
+            if missing:
+                raise UdimMappingError('These UDIMs do not exist %s' %formatUdims(missing))
+        if not snapshot:
+            chained = self.chained()
+            if chained:
+                raise UdimMappingError('These UDIMs are copied from and pasted to %s' %formatUdims(chained))
+
+# ------------------------------------------------------------------------------
+def parseSelection(text, available=None, unique=True):
+    "Returns the UDIMs selected by the text in the order the terms are given, see the top of this file for the syntax."
+    space = _udimSpace(available)
+    selected = []
+    seen = set()
+    terms = [term.strip().lower() for term in text.split(',')]
+    if terms == ['']:
+        raise UdimMappingError('Please enter the UDIMs to use.')
+    for term in terms:
+        for udim in sorted(_parseTerm(term, space)):
+            if unique and udim in seen:
+                continue
+            seen.add(udim)
+            selected.append(udim)
+    return selected
+
+# ------------------------------------------------------------------------------
+def parseMapping(copy_text, paste_text, available=None):
+    "Returns the UdimMapping for a copy selection and a paste selection or transform, the mapping isn't validated."
+    copy_udims = parseSelection(copy_text, available)
+    if isTransform(paste_text):
+        paste_udims = transformUdims(copy_udims, paste_text)
+    else:
+        paste_udims = parseSelection(paste_text, available, unique=False)
+        if len(paste_udims) != len(copy_udims):
+            raise UdimMappingError('Copy selects %d UDIMs but paste selects %d.' %(len(copy_udims), len(paste_udims)))
+    return UdimMapping(zip(copy_udims, paste_udims))
+
+# ------------------------------------------------------------------------------
+def isTransform(text):
+    "Returns True if the text is made of transforms rather than a selection."
+    terms = text.lower().split()
+    return len(terms) > 0 and all([_OFFSET_TERM.match(term) or _FLIP_TERM.match(term) for term in terms])
+
+# ------------------------------------------------------------------------------
+def transformUdims(udims, text):
+    "Returns the UDIMs moved by every transform in the text, in the same order as the UDIMs given."
+    us = [(udim - UDIM_START) % UDIM_COLUMNS for udim in udims]
+    vs = [(udim - UDIM_START) // UDIM_COLUMNS for udim in udims]
+    offset = 0
+    for term in text.lower().split():
+        flip = _FLIP_TERM.match(term)
+        if flip:
+            if flip.group(1) == 'u':
+                us = [min(us) + max(us) - u for u in us]
+            else:
+                vs = [min(vs) + max(vs) - v for v in vs]
+            continue
+        axis, amount = _OFFSET_TERM.match(term).groups()
+        if axis == 'u':
+            us = [u + int(amount) for u in us]
+        elif axis == 'v':
+            vs = [v + int(amount) for v in vs]
+        else:
+            offset += int(amount)
+    outside = [udims[index] for index, u in enumerate(us) if u < 0 or u >= UDIM_COLUMNS]
+    if outside:
+        raise UdimMappingError('These UDIMs would move outside the %d UDIM columns %s' %(UDIM_COLUMNS, formatUdims(outside)))
+    moved = [UDIM_START + u + v * UDIM_COLUMNS + offset for u, v in zip(us, vs)]
+    outside = [udims[index] for index, udim in enumerate(moved) if udim < UDIM_START or udim > UDIM_END]
+    if outside:
+        raise UdimMappingError('These UDIMs would move outside %d-%d %s' %(UDIM_START, UDIM_END, formatUdims(outside)))
+    return moved
+
+# ------------------------------------------------------------------------------
+def formatUdims(udims, limit=20):
+    "Returns the UDIMs as a short comma separated string with consecutive UDIMs joined into ranges."
+    ranges = []
+    for udim in sorted(set(udims)):
+        if ranges and udim == ranges[-1][1] + 1:
+            ranges[-1][1] = udim
+        else:
+            ranges.append([udim, udim])
+    text = [str(start) if start == end else '%d-%d' %(start, end) for start, end in ranges]
+    if len(text) > limit:
+        text = text[:limit] + ['...']
+    return ', '.join(text)
+
+# ------------------------------------------------------------------------------
+def _udimSpace(available):
+    "Returns the set of UDIMs rows, columns and * select from."
+    if available is None:
+        return set(range(UDIM_START, UDIM_END + 1))
+    return set(available)
+
+# ------------------------------------------------------------------------------
+def _parseTerm(term, space):
+    "Returns the UDIMs selected by one selection term."
+    if term == '*':
+        return space
+    match = _RANGE_TERM.match(term)
+    if match:
+        start, end, step = match.groups()
+        start = int(start)
+        end = int(end or start)
+        step = int(step or 1)
+        if start < UDIM_START or end < UDIM_START or step < 1:
+            raise UdimMappingError('"%s" is not a valid UDIM range, UDIMs start at %d.' %(term, UDIM_START))
+        if end < start:
+            start, end = end, start
+        return range(start, end + 1, step)
+    match = _ROW_COLUMN_TERM.match(term)
+    if match:
+        axis, first, last = match.groups()
+        first = int(first)
+        last = int(last or first)
+        if first < 1 or last < first or (axis == 'u' and last > UDIM_COLUMNS):
+            raise UdimMappingError('"%s" is not a valid row or column.' %term)
+        if axis == 'u':
+            return [udim for udim in space if first <= (udim - UDIM_START) % UDIM_COLUMNS + 1 <= last]
+        return [udim for udim in space if first <= (udim - UDIM_START) // UDIM_COLUMNS + 1 <= last]
+    raise UdimMappingError('"%s" is not a UDIM, range, row or column.' %term)